@@ -1,29 +1,73 @@
 import viktor as vkt # type: ignore
 import os
+import html as html_lib
 
-from pathlib import Path
-from tools import process_cad_file, get_token
+from jobs import get_job_manager
+from tools import get_viewer_token, get_manifest_index, OUTPUT_FORMAT, VIEWER_ENVIRONMENTS
+from viewer_template import get_template, to_js
+
+# Seconds a render waits for its job before showing the progress page (cache hits finish well within this).
+JOB_INITIAL_WAIT = 3
+# Viewer extensions loaded with the model, e.g. ["Autodesk.DocumentBrowser"].
+VIEWER_EXTENSIONS: list[str] = []
+
+# Start the job manager with the app, so translations a previous process left unfinished are picked up right away
+# instead of on the first render
+get_job_manager()
 
 class APSView(vkt.WebView):
     pass
 
 class APSresult(vkt.WebResult):
-    def __init__(self, file: vkt.File, name: str, client_id: str,  client_secret: str, bucket_id: str | None = None):
-        file_bytes: bytes = file.getvalue_binary()
-        
-        token = get_token(client_id=client_id, client_secret=client_secret)
-        urn = process_cad_file(
-            file_content=file_bytes, object_name=name, token = token, client_id=client_id
+    def __init__(self, file: vkt.File, name: str, client_id: str,  client_secret: str, bucket_id: str | None = None, output_format: str = OUTPUT_FORMAT, viewable: str | None = None, sheet_picker: bool = True):
+        # Upload and translation run in the background; the file is streamed into the job, not loaded in memory
+        with file.open_binary() as file_stream:
+            job = get_job_manager().submit(
+                name=name, file_content=file_stream, client_id=client_id, client_secret=client_secret, output_format=output_format
+            )
+        job.wait(timeout=JOB_INITIAL_WAIT)
+        if job.stage == "failed":
+            raise vkt.UserError(f"Processing '{name}' failed: {job.error}")
+        if not job.finished:
+            html = get_template('ApsProgress.html').render(
+                job_name=html_lib.escape(name),
+                job_stage=job.stage,
+                job_detail=html_lib.escape(f"({job.detail})" if job.detail else ""),
+            )
+            super().__init__(html=html)
+            return
+
+        # The browser only gets a read-only viewer token, never the upload token. viewables:read also covers the
+        # manifest, so the same token resolves the index when it is not cached yet.
+        token = get_viewer_token(client_id=client_id, client_secret=client_secret)
+        # Resolve the requested sheet/view from the (cached) manifest index, so the viewer opens it directly
+        index = get_manifest_index(token, job.urn)
+        viewables = index.viewables([output_format]) if index else []
+        viewable_guid = None
+        if viewable:
+            match = index.find(viewable, [output_format]) if index else None
+            if match is None:
+                available = ", ".join(v.name for v in viewables)
+                raise vkt.UserError(f"'{name}' has no sheet or view '{viewable}'. Available: {available}")
+            viewable_guid = match.guid
+
+        html = get_template('ApsViewer.html').render(
+            aps_token=token,
+            urn=job.urn,
+            # The viewer env/api has to match the derivative format (SVF2 is streamed from AutodeskProduction2)
+            aps_env=VIEWER_ENVIRONMENTS[output_format]["env"],
+            aps_api=VIEWER_ENVIRONMENTS[output_format]["api"],
+            viewable_guid=to_js(viewable_guid),
+            extensions=to_js(VIEWER_EXTENSIONS),
+            # With several viewables the viewer shows a sheet picker and loads them one at a time
+            viewables=to_js([{"guid": v.guid, "name": v.name, "role": v.role} for v in viewables] if sheet_picker else []),
         )
-        
-        html = (Path(__file__).parent / 'ApsViewer.html').read_text()
-        html = html.replace('APS_TOKEN_PLACEHOLDER', token)
-        html = html.replace('URN_PLACEHOLDER', urn)
         super().__init__(html=html)
 
 class Parametrization(vkt.Parametrization):
     title = vkt.Text("# APS Integration")
     cad_file = vkt.FileField("Upload Your CAD File!")
+    viewable = vkt.TextField("Sheet or view (name or GUID, optional)")
 
 class Controller(vkt.Controller):
     parametrization = Parametrization(width=40)
@@ -39,4 +83,4 @@ class Controller(vkt.Controller):
         if not client_id or not client_secret:
             raise vkt.UserError("CLIENT_ID and CLIENT_SECRET must be set in the environment variables.")
         
-        return APSresult(file=file, name=name, client_id=client_id, client_secret=client_secret)
+        return APSresult(file=file, name=name, client_id=client_id, client_secret=client_secret, viewable=params.viewable)
@@ -0,0 +1,273 @@
+"""asyncio variant of the APS client in tools.py.
+
+Covers token, bucket, signed upload, job submit and manifest. Request payloads, token caching, manifest parsing
+the retry policy, rate limits and the poll schedule are shared with tools.py, so both clients behave the same. Use this one when many
+translations have to be tracked at once: they are all polled from one event loop instead of one sleeping
+thread each.
+
+    async with AsyncAPSClient(client_id, client_secret) as aps:
+        statuses = await aps.wait_for_many(urns)
+"""
+import math
+import asyncio
+import httpx #type: ignore
+
+from typing import AsyncIterator, Awaitable, Callable
+
+import retry
+import ratelimit
+import tools
+from upload_source import CHUNK_SIZE, FileContent, UploadSource, as_upload_source
+
+# Upper bound on manifest polls that are in flight at the same time.
+MAX_CONCURRENT_POLLS = 50
+# httpx exceptions meaning no response was received, and those of them meaning no connection was made (see retry.py).
+TRANSPORT_ERRORS = (httpx.TransportError,)
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class AsyncAPSClient:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        max_connections: int = tools.HTTP_POOL_SIZE,
+        max_concurrent_polls: int = MAX_CONCURRENT_POLLS,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=30,
+        )
+        self._poll_semaphore = asyncio.Semaphore(max_concurrent_polls)
+        self._token_locks: dict[str, asyncio.Lock] = {}
+
+    async def __aenter__(self) -> "AsyncAPSClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        endpoint: str,
+        idempotent: bool | None = None,
+        make_content: Callable[[], AsyncIterator[bytes]] | None = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """Async counterpart of tools.aps_request. `make_content` rebuilds a streamed body for every attempt."""
+        family = tools.ENDPOINT_FAMILIES.get(endpoint, endpoint)
+        limiter = ratelimit.get_rate_limiter()
+        if idempotent is None:
+            idempotent = method.upper() in ("GET", "HEAD", "PUT")
+
+        async def send() -> httpx.Response:
+            # In a thread: with APS_RATE_LIMIT_DIR the limiter takes a file lock, which would block the event loop
+            while wait := await asyncio.to_thread(limiter.try_acquire, family):
+                await asyncio.sleep(wait)
+            if make_content is not None:
+                kwargs["content"] = make_content()
+            return await self._client.request(method, url, **kwargs)
+
+        return await retry.get_policy().acall(endpoint, send, idempotent, TRANSPORT_ERRORS, CONNECT_ERRORS)
+
+    async def get_token(self, scope: str = tools.SCOPES) -> str:
+        """Same cache as tools.get_token, so tokens are shared between the sync and async clients."""
+        async with self._token_locks.setdefault(scope, asyncio.Lock()):
+            token = tools.cached_token(self.client_id, scope)
+            if token:
+                return token
+            response = await self._request(
+                "POST",
+                tools.AUTH_URL,
+                "token",
+                idempotent=True,
+                data=tools.token_request_data(self.client_id, self.client_secret, scope),
+                timeout=15,
+            )
+            response.raise_for_status()
+            return tools.store_token(self.client_id, scope, response.json())
+
+    async def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {await self.get_token()}"}
+
+    async def create_bucket_if_not_exists(self, bucket_key: str) -> None:
+        response = await self._request(
+            "POST",
+            f"{tools.OSS_BASE_URL}/buckets",
+            "create_bucket",
+            idempotent=True,
+            json={"bucketKey": bucket_key, "policyKey": "transient"},
+            headers=await self._auth_headers(),
+            timeout=15,
+        )
+        if response.status_code not in [200, 409]:
+            response.raise_for_status()
+
+    async def get_signed_upload_urls(
+        self,
+        s3_upload_endpoint: str,
+        parts: int = 1,
+        first_part: int = 1,
+        upload_key: str | None = None,
+        minutes_expiration: int = tools.UPLOAD_URL_EXPIRATION,
+    ) -> dict:
+        params = {"parts": parts, "firstPart": first_part, "minutesExpiration": minutes_expiration}
+        if upload_key:
+            params["uploadKey"] = upload_key
+        response = await self._request(
+            "GET", s3_upload_endpoint, "presign", params=params, headers=await self._auth_headers(), timeout=15
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _put_part(
+        self,
+        url: str,
+        source: UploadSource,
+        offset: int,
+        length: int,
+        presign_again: Callable[[], Awaitable[str]] | None = None,
+    ) -> None:
+        """Async counterpart of tools._put_part, including presigning the part again once after a 403."""
+        length = min(length, source.size - offset)
+
+        async def chunks():
+            # A fresh reader per attempt, so a retried part is sent from its start
+            with source.open_part(offset, length) as part:
+                while chunk := await asyncio.to_thread(part.read, CHUNK_SIZE):
+                    yield chunk
+
+        # An explicit Content-Length keeps the streamed body from being sent chunked, which S3 rejects.
+        response = await self._request(
+            "PUT", url, "s3_put", make_content=chunks, headers={"Content-Length": str(length)}, timeout=120
+        )
+        if response.status_code == 403 and presign_again is not None:
+            response = await self._request(
+                "PUT", await presign_again(), "s3_put", make_content=chunks,
+                headers={"Content-Length": str(length)}, timeout=120,
+            )
+        response.raise_for_status()
+
+    async def upload_to_OSS(
+        self,
+        object_name: str,
+        file_content: FileContent | UploadSource,
+        bucket_key: str,
+        part_size: int = tools.UPLOAD_PART_SIZE,
+        concurrency: int = tools.UPLOAD_CONCURRENCY,
+    ) -> str:
+        """Async counterpart of tools.upload_to_OSS: single-shot for small files, parallel parts for large ones."""
+        s3_upload_endpoint = f"{tools.OSS_BASE_URL}/buckets/{bucket_key}/objects/{object_name}/signeds3upload"
+        with as_upload_source(file_content) as source:
+            size = source.size
+            total_parts = max(1, math.ceil(size / part_size))
+            semaphore = asyncio.Semaphore(concurrency)
+            upload_key = None
+
+            async def presign_again(part_number: int) -> str:
+                return (await self.get_signed_upload_urls(s3_upload_endpoint, 1, part_number, upload_key))["urls"][0]
+
+            async def put_part(url: str, part_number: int) -> None:
+                try:
+                    await self._put_part(
+                        url, source, (part_number - 1) * part_size, part_size, lambda: presign_again(part_number)
+                    )
+                finally:
+                    semaphore.release()
+
+            urls: dict[int, str] = {}
+            tasks = []
+            for part_number in range(1, total_parts + 1):
+                # A free slot first, so each batch of URLs is only requested once the parts before it are nearly
+                # done, instead of all batches at the start of a long upload
+                await semaphore.acquire()
+                if part_number not in urls:
+                    parts = min(tools.MAX_PARTS_PER_REQUEST, total_parts - part_number + 1)
+                    try:
+                        signed_url_data = await self.get_signed_upload_urls(
+                            s3_upload_endpoint, parts, part_number, upload_key
+                        )
+                    except BaseException:
+                        semaphore.release()
+                        raise
+                    upload_key = signed_url_data["uploadKey"]
+                    urls.update(enumerate(signed_url_data["urls"], start=part_number))
+                tasks.append(asyncio.create_task(put_part(urls.pop(part_number), part_number)))
+            await asyncio.gather(*tasks)
+
+        response = await self._request(
+            "POST", s3_upload_endpoint, "finalize", json={"uploadKey": upload_key, "size": size},
+            headers=await self._auth_headers(),
+        )
+        response.raise_for_status()
+        return response.json()["objectId"]
+
+    async def start_translation_job(
+        self,
+        object_urn: str,
+        workflow: str | None = None,
+        force: bool = False,
+        output_format: str = tools.OUTPUT_FORMAT,
+        views: list[str] = tools.OUTPUT_VIEWS,
+    ) -> bool:
+        """Async counterpart of tools.start_svf_translation_job; skips the job if a derivative already exists."""
+        if not force and tools.has_viewable_derivative(await self.get_manifest(object_urn), [output_format]):
+            return False
+        headers, job_payload = tools.translation_job_request(
+            await self.get_token(), object_urn, workflow, force, output_format, views
+        )
+        response = await self._request(
+            "POST", f"{tools.MD_BASE_URL}/designdata/job", "job_submit", idempotent=not force,
+            headers=headers, json=job_payload,
+        )
+        response.raise_for_status()
+        return True
+
+    async def get_manifest(self, object_urn: str) -> dict | None:
+        async with self._poll_semaphore:
+            response = await self._request(
+                "GET", f"{tools.MD_BASE_URL}/designdata/{object_urn}/manifest", "manifest",
+                headers=await self._auth_headers(),
+            )
+        if response.status_code in [202, 404]:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def get_translation_status(self, object_urn: str) -> tuple[str, str]:
+        return tools.translation_status(await self.get_manifest(object_urn))
+
+    async def wait_for_translation(
+        self,
+        object_urn: str,
+        initial_delay: float = tools.POLL_INITIAL_DELAY,
+        max_delay: float = tools.POLL_MAX_DELAY,
+        timeout: float = tools.TRANSLATION_TIMEOUT,
+    ) -> str:
+        """Polls until the translation finished and returns its final status ("success" or "failed")."""
+        schedule = tools.PollSchedule(initial_delay, max_delay, timeout)
+        while True:
+            try:
+                md_status, md_progress = await self.get_translation_status(object_urn)
+                if md_status in ["success", "failed", "timeout"]:
+                    return "success" if md_status == "success" else "failed"
+                schedule.observe(md_progress)
+            except httpx.HTTPError:
+                schedule.observe(None)
+            await asyncio.sleep(schedule.next_delay())
+
+    async def wait_for_many(self, object_urns: list[str], **kwargs) -> dict[str, str]:
+        """Waits for many translations at once; in-flight polls are bounded by `max_concurrent_polls`.
+        Returns urn -> "success", "failed" or the error message of a URN that could not be tracked.
+        """
+        results = await asyncio.gather(
+            *(self.wait_for_translation(urn, **kwargs) for urn in object_urns), return_exceptions=True
+        )
+        return {urn: result if isinstance(result, str) else str(result) for urn, result in zip(object_urns, results)}
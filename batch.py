@@ -0,0 +1,214 @@
+"""Batch ingestion of many CAD files at once.
+
+    python batch.py path/to/project --pattern "*.dwg" --out results.csv
+    python batch.py --manifest files.txt --upload-concurrency 8
+
+Files are uploaded on a bounded pool and each translation is submitted as soon as its upload finishes.
+All pending URNs are then polled from one scheduler loop, each on its own PollSchedule; the polls that are due
+at the same time are sent in parallel. The results are written as a CSV table.
+"""
+import os
+import csv
+import time
+import argparse
+import requests #type: ignore
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from tools import (
+    OUTPUT_FORMAT,
+    OUTPUT_VIEWS,
+    POLL_MAX_DELAY,
+    TRANSLATION_TIMEOUT,
+    PollSchedule,
+    get_svf_translation_status,
+    get_token,
+    submit_cad_file,
+    TokenProvider,
+)
+import result_cache
+
+# Number of files hashed and uploaded at the same time.
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get("APS_BATCH_UPLOAD_CONCURRENCY", "4"))
+BATCH_POLL_INITIAL_DELAY = 5.0
+# Number of manifest polls sent at the same time.
+BATCH_POLL_CONCURRENCY = int(os.environ.get("APS_BATCH_POLL_CONCURRENCY", "8"))
+
+
+@dataclass
+class BatchResult:
+    file: str
+    urn: str = ""
+    status: str = "pending"  # pending -> uploaded -> success | failed | timeout
+    size: int = 0
+    upload_seconds: float = 0.0
+    translate_seconds: float = 0.0
+    total_seconds: float = 0.0
+    error: str = ""
+
+
+@dataclass
+class _PendingTranslation:
+    content_hash: str
+    schedule: PollSchedule
+    submitted_at: float = field(default_factory=time.monotonic)
+    next_poll: float = 0.0
+    results: list[BatchResult] = field(default_factory=list)  # rows of all files with this content
+
+
+def collect_files(directory: str | None = None, manifest: str | None = None, pattern: str = "*") -> list[Path]:
+    """Files to ingest: everything matching `pattern` below `directory`, and/or the paths listed in `manifest`
+    (one per line, relative paths are resolved against the manifest's folder, # starts a comment).
+    """
+    files: list[Path] = []
+    if directory:
+        files += sorted(path for path in Path(directory).rglob(pattern) if path.is_file())
+    if manifest:
+        base = Path(manifest).parent
+        for line in Path(manifest).read_text().splitlines():
+            line = line.split("#", 1)[0].strip()
+            if line:
+                files.append(base / line)
+    return files
+
+
+def ingest(
+    files: list[Path],
+    client_id: str,
+    client_secret: str,
+    upload_concurrency: int = BATCH_UPLOAD_CONCURRENCY,
+    output_format: str = OUTPUT_FORMAT,
+    views: list[str] = OUTPUT_VIEWS,
+    timeout: float = TRANSLATION_TIMEOUT,
+) -> list[BatchResult]:
+    """Uploads and translates `files`, returning one result row per file in the same order."""
+    results = [BatchResult(file=str(path)) for path in files]
+    pending: dict[str, _PendingTranslation] = {}  # urn -> translation being polled
+
+    def upload(result: BatchResult):
+        upload_started = time.monotonic()
+        result.size = os.path.getsize(result.file)
+        submitted = submit_cad_file(
+            object_name=Path(result.file).name,
+            file_content=result.file,
+            token=TokenProvider(client_id, client_secret),
+            client_id=client_id,
+            output_format=output_format,
+            views=views,
+        )
+        result.upload_seconds = time.monotonic() - upload_started
+        return submitted
+
+    with (
+        ThreadPoolExecutor(max_workers=upload_concurrency) as executor,
+        ThreadPoolExecutor(max_workers=BATCH_POLL_CONCURRENCY) as poll_executor,
+    ):
+        futures = {executor.submit(upload, result): result for result in results}
+        while futures or pending:
+            # Register finished uploads; their translations were submitted already
+            for future in [f for f in futures if f.done()]:
+                result = futures.pop(future)
+                try:
+                    submitted = future.result()
+                except Exception as e:
+                    result.status, result.error = "failed", str(e)
+                    continue
+                result.urn = submitted.urn
+                if submitted.translated:
+                    result.status = "success"
+                else:
+                    result.status = "uploaded"
+                    # A file with the same content as one that is already translating shares its entry
+                    if submitted.urn not in pending:
+                        schedule = PollSchedule(BATCH_POLL_INITIAL_DELAY, POLL_MAX_DELAY, timeout)
+                        pending[submitted.urn] = _PendingTranslation(submitted.content_hash, schedule)
+                        pending[submitted.urn].next_poll = time.monotonic() + schedule.next_delay()
+                    pending[submitted.urn].results.append(result)
+
+            _poll_due(pending, client_id, client_secret, output_format, poll_executor)
+
+            next_poll = min((entry.next_poll for entry in pending.values()), default=time.monotonic() + 1)
+            wait = max(0.0, min(next_poll - time.monotonic(), 1.0))
+            if futures:
+                # Wake up as soon as another upload finishes
+                wait_futures(list(futures), timeout=wait, return_when=FIRST_COMPLETED)
+            elif pending:
+                time.sleep(wait)
+
+    for result in results:
+        result.upload_seconds = round(result.upload_seconds, 3)
+        result.total_seconds = round(result.upload_seconds + result.translate_seconds, 3)
+    return results
+
+
+def _poll_due(
+    pending: dict[str, _PendingTranslation],
+    client_id: str,
+    client_secret: str,
+    output_format: str,
+    poll_executor: ThreadPoolExecutor,
+) -> None:
+    """Polls every pending URN whose next poll time has come, all at once on `poll_executor`."""
+    now = time.monotonic()
+    due = [urn for urn, entry in pending.items() if entry.next_poll <= now]
+    if not due:
+        return
+    token = get_token(client_id, client_secret)
+
+    def poll(urn: str) -> tuple[str, str | None]:
+        try:
+            return get_svf_translation_status(token, urn)
+        except requests.exceptions.RequestException:
+            return "inprogress", None
+
+    for urn, (status, progress) in zip(due, poll_executor.map(poll, due)):
+        entry = pending[urn]
+        now = time.monotonic()
+        elapsed = now - entry.submitted_at
+        if status in ["success", "failed", "timeout"] or now >= entry.schedule.deadline:
+            for result in entry.results:
+                result.status = status if status in ["success", "failed"] else "timeout"
+                result.translate_seconds = round(elapsed, 3)
+            if status == "success":
+                result_cache.get_result_cache().put(client_id, entry.content_hash, output_format, urn)
+            del pending[urn]
+        else:
+            entry.schedule.observe(progress)
+            entry.next_poll = now + entry.schedule.next_delay()
+
+
+def write_results(results: list[BatchResult], path: str) -> None:
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(BatchResult.__dataclass_fields__))
+        writer.writeheader()
+        for result in results:
+            writer.writerow(asdict(result))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upload and translate many CAD files with APS.")
+    parser.add_argument("directory", nargs="?", help="Folder to ingest (searched recursively)")
+    parser.add_argument("--manifest", help="Text file listing the files to ingest, one per line")
+    parser.add_argument("--pattern", default="*", help="Glob pattern for files in the folder, e.g. '*.dwg'")
+    parser.add_argument("--out", default="results.csv", help="CSV file the results table is written to")
+    parser.add_argument("--upload-concurrency", type=int, default=BATCH_UPLOAD_CONCURRENCY)
+    parser.add_argument("--format", default=OUTPUT_FORMAT, choices=["svf", "svf2"])
+    args = parser.parse_args()
+
+    if not args.directory and not args.manifest:
+        parser.error("pass a directory and/or --manifest")
+    client_id = os.environ.get("CLIENT_ID")
+    client_secret = os.environ.get("CLIENT_SECRET")
+    if not client_id or not client_secret:
+        parser.error("CLIENT_ID and CLIENT_SECRET must be set in the environment variables.")
+
+    files = collect_files(args.directory, args.manifest, args.pattern)
+    results = ingest(files, client_id, client_secret, args.upload_concurrency, args.format)
+    write_results(results, args.out)
+    succeeded = sum(result.status == "success" for result in results)
+    print(f"{succeeded}/{len(results)} files translated, results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""End-to-end benchmarks of process_cad_file against the local fake APS (fake_aps.py).
+
+Measures job latency, job throughput, upload throughput and per-stage timings over a matrix of file sizes
+and concurrency levels. Results are saved as JSON and can be compared against an earlier run:
+
+    python benchmark.py --sizes 1,16,64 --concurrency 1,4,8 --out benchmark_results/latest.json
+    python benchmark.py --compare benchmark_results/baseline.json --threshold 0.1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import tools
+import retry
+import telemetry
+import ratelimit
+import result_cache
+from fake_aps import FakeAPSConfig, FakeAPSServer
+
+MB = 1024 * 1024
+CLIENT_ID = "benchmark-client"
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def run_case(size_mb: float, concurrency: int, jobs: int, workdir: str) -> dict:
+    """Runs `jobs` process_cad_file calls with `concurrency` in parallel on fresh random files of `size_mb`."""
+    # Random content, so content-hash dedup and the result cache don't short-circuit the pipeline
+    paths = []
+    for i in range(jobs):
+        path = os.path.join(workdir, f"bench-{size_mb}mb-{concurrency}-{i}.dwg")
+        with open(path, "wb") as f:
+            remaining = int(size_mb * MB)
+            while remaining:
+                chunk = min(remaining, MB)
+                f.write(os.urandom(chunk))
+                remaining -= chunk
+        paths.append(path)
+
+    sink = telemetry.add_sink(telemetry.InMemorySink())
+    token = tools.TokenProvider(CLIENT_ID, "secret")
+
+    def run(path: str) -> float:
+        started = time.perf_counter()
+        tools.process_cad_file(object_name=os.path.basename(path), file_content=path, token=token, client_id=CLIENT_ID)
+        return time.perf_counter() - started
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(run, paths))
+        wall = time.perf_counter() - started
+    finally:
+        telemetry.remove_sink(sink)
+        for path in paths:
+            os.remove(path)
+
+    upload_seconds = sum(sink.durations("upload"))
+    return {
+        "size_mb": size_mb,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "wall_seconds": round(wall, 3),
+        "latency_p50": round(statistics.median(latencies), 3),
+        "latency_p95": round(_percentile(latencies, 0.95), 3),
+        "latency_max": round(max(latencies), 3),
+        "jobs_per_second": round(jobs / wall, 3),
+        "upload_mb_per_second": round(size_mb * jobs / upload_seconds, 2) if upload_seconds else None,
+        "stages_p50": {
+            name: round(statistics.median(sink.durations(name)), 4)
+            for name in sorted({span.name for span in sink.spans})
+        },
+    }
+
+
+def run_benchmarks(
+    sizes: list[float], concurrencies: list[int], jobs: int, config: FakeAPSConfig
+) -> dict:
+    with FakeAPSServer(config) as server, tempfile.TemporaryDirectory() as workdir:
+        previous_base_url, previous_bucket_cache = tools.APS_BASE_URL, tools.BUCKET_CACHE_PATH
+        previous_policy = retry.get_policy()
+        tools.configure_base_url(server.base_url)
+        # Scratch caches: buckets and results of the real config must neither leak in nor be overwritten
+        tools.configure_bucket_cache(None)
+        result_cache.set_result_cache(result_cache.ResultCache(os.path.join(workdir, "results.sqlite3")))
+        # No client-side rate limits (they would cap the measured throughput, and with APS_RATE_LIMIT_DIR drain
+        # the quota shared with live workers) and fresh retry budgets
+        ratelimit.set_rate_limiter(ratelimit.RateLimiter({}))
+        retry.set_policy(retry.RetryPolicy())
+        try:
+            cases = [run_case(size, concurrency, jobs, workdir) for size in sizes for concurrency in concurrencies]
+        finally:
+            tools.configure_base_url(previous_base_url)
+            tools.configure_bucket_cache(previous_bucket_cache)
+            result_cache.set_result_cache(None)
+            ratelimit.set_rate_limiter(None)
+            retry.set_policy(previous_policy)
+        requests_per_route = {f"{method} {route}": count for (method, route), count in server.state.requests.items()}
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(config).items()},
+        "cases": cases,
+        "requests": requests_per_route,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Lists the cases where latency or throughput got worse than the baseline by more than `threshold`."""
+    baseline_cases = {(case["size_mb"], case["concurrency"]): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        before = baseline_cases.get((case["size_mb"], case["concurrency"]))
+        if before is None:
+            continue
+        label = f"{case['size_mb']} MB x {case['concurrency']}"
+        if case["latency_p50"] > before["latency_p50"] * (1 + threshold):
+            regressions.append(f"{label}: p50 latency {before['latency_p50']} s -> {case['latency_p50']} s")
+        if case["jobs_per_second"] < before["jobs_per_second"] * (1 - threshold):
+            regressions.append(f"{label}: throughput {before['jobs_per_second']} -> {case['jobs_per_second']} jobs/s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark process_cad_file against a local fake APS.")
+    parser.add_argument("--sizes", default="1,16", help="Comma-separated file sizes in MB")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated numbers of parallel jobs")
+    parser.add_argument("--jobs", type=int, default=4, help="Jobs per case")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake API latency per request (s)")
+    parser.add_argument("--bandwidth", type=float, default=50, help="Fake upload bandwidth per connection (MB/s)")
+    parser.add_argument("--translation-duration", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default=None, help="Where to save the results (default: benchmark_results/<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    config = FakeAPSConfig(
+        latency=args.latency,
+        bandwidth=args.bandwidth * MB if args.bandwidth else None,
+        translation_duration=args.translation_duration,
+        error_rate=args.error_rate,
+    )
+    results = run_benchmarks(
+        [float(size) for size in args.sizes.split(",")], [int(c) for c in args.concurrency.split(",")], args.jobs, config
+    )
+
+    out = Path(args.out or f"benchmark_results/{datetime.now():%Y%m%d-%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    for case in results["cases"]:
+        print(
+            f"{case['size_mb']:>6} MB x {case['concurrency']:<3} p50 {case['latency_p50']:>7} s  "
+            f"p95 {case['latency_p95']:>7} s  {case['jobs_per_second']:>6} jobs/s  "
+            f"upload {case['upload_mb_per_second']} MB/s"
+        )
+    print(f"Results written to {out}")
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(args.compare).read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
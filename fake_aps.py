@@ -0,0 +1,544 @@
+"""Local stand-in for the APS endpoints used by tools.py, for benchmarks and load tests without Autodesk.
+
+Implements the 2-legged token, OSS buckets/object details/signeds3upload, an S3-like PUT for the presigned
+URLs, Model Derivative job/manifest, metadata (views, object tree, properties) and webhook registration.
+Latency, per-connection upload bandwidth, translation duration and error injection are configurable.
+Registered hooks are called back with `extraction.finished` when a job submitted with their workflow id finishes.
+
+    python fake_aps.py --port 9000 --translation-duration 5
+    APS_BASE_URL=http://127.0.0.1:9000 viktor-cli start
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib.request
+
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+@dataclass
+class FakeAPSConfig:
+    latency: float = 0.0  # seconds added to every API request
+    bandwidth: float | None = None  # bytes/s per S3 PUT connection, None for unlimited
+    translation_duration: float = 5.0  # seconds from job submission to a successful manifest
+    error_rate: float = 0.0  # fraction of API requests answered with one of `error_statuses`
+    error_statuses: tuple[int, ...] = (429, 503)
+    retry_after: float = 1.0  # Retry-After header sent with injected errors
+    translation_failure_rate: float = 0.0  # fraction of translations that end up "failed"
+    token_lifetime: float = 3599.0  # seconds an issued token is accepted; API calls with other tokens get 401
+    # Seconds one minute of `minutesExpiration` lasts for presigned URLs (APS defaults to 2 minutes); lower it to
+    # make URLs expire during a test
+    seconds_per_expiration_minute: float = 60.0
+    sheets: int = 2  # 2D viewables in every successful manifest (next to one 3D view)
+    objects_per_view: int = 50  # leaf objects in every view's object tree and properties
+    # Above this many objects, object tree and properties answer 413 unless forceget=true is passed
+    max_objects_without_forceget: int = 1000
+    # Above this many objects even forceget is refused, so only the paginated properties:query works
+    max_objects_with_forceget: int = 100_000
+
+
+@dataclass
+class _Translation:
+    submitted_at: float
+    output_format: str
+    failed: bool
+    workflow: str | None = None
+
+
+class FakeAPSState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: set[str] = set()
+        self.objects: dict[tuple[str, str], int] = {}  # (bucket, key) -> size
+        self.uploads: dict[str, dict[int, int]] = {}  # uploadKey -> part -> size
+        self.translations: dict[str, _Translation] = {}  # urn -> translation
+        self.extracted_views: set[tuple[str, str]] = set()  # (urn, guid) whose properties have been asked for
+        self.hooks: dict[str, set[str]] = {}  # workflow id -> callback URLs of its extraction.finished hooks
+        self.callbacks_sent = 0
+        self.requests: Counter = Counter()  # (method, route) -> count
+        self.tokens: dict[str, float] = {}  # issued access token -> monotonic expiry time
+        self.bytes_received = 0
+
+
+ROUTES = [
+    ("POST", "token", re.compile(r"^/authentication/v2/token$")),
+    ("POST", "create_bucket", re.compile(r"^/oss/v2/buckets$")),
+    ("GET", "object_details", re.compile(r"^/oss/v2/buckets/(?P<bucket>[^/]+)/objects/(?P<key>[^/]+)/details$")),
+    ("GET", "presign", re.compile(r"^/oss/v2/buckets/(?P<bucket>[^/]+)/objects/(?P<key>[^/]+)/signeds3upload$")),
+    ("POST", "finalize", re.compile(r"^/oss/v2/buckets/(?P<bucket>[^/]+)/objects/(?P<key>[^/]+)/signeds3upload$")),
+    ("PUT", "s3_put", re.compile(r"^/s3/(?P<upload_key>[^/]+)/(?P<part>\d+)$")),
+    ("POST", "job", re.compile(r"^/modelderivative/v2/designdata/job$")),
+    ("GET", "manifest", re.compile(r"^/modelderivative/v2/designdata/(?P<urn>[^/]+)/manifest$")),
+    ("GET", "metadata", re.compile(r"^/modelderivative/v2/designdata/(?P<urn>[^/]+)/metadata$")),
+    ("GET", "object_tree", re.compile(r"^/modelderivative/v2/designdata/(?P<urn>[^/]+)/metadata/(?P<guid>[^/]+)$")),
+    ("GET", "properties", re.compile(r"^/modelderivative/v2/designdata/(?P<urn>[^/]+)/metadata/(?P<guid>[^/]+)/properties$")),
+    (
+        "POST",
+        "properties_query",
+        re.compile(r"^/modelderivative/v2/designdata/(?P<urn>[^/]+)/metadata/(?P<guid>[^/]+)/properties:query$"),
+    ),
+    ("POST", "webhook", re.compile(r"^/webhooks/v1/systems/[^/]+/events/[^/]+/hooks$")),
+]
+
+
+class FakeAPSServer:
+    """Runs the fake APS on a background thread. Use as a context manager or call start()/stop()."""
+
+    def __init__(self, config: FakeAPSConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeAPSConfig()
+        self.state = FakeAPSState()
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAPSServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-aps", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeAPSServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def manifest(self, urn: str) -> dict | None:
+        with self.state.lock:
+            translation = self.state.translations.get(urn)
+        if translation is None:
+            return None
+        elapsed = time.monotonic() - translation.submitted_at
+        duration = self.config.translation_duration
+        if elapsed < duration:
+            progress = f"{int(elapsed / duration * 100) if duration else 99}% complete"
+            return {"type": "manifest", "urn": urn, "status": "inprogress", "progress": progress, "derivatives": []}
+        status = "failed" if translation.failed else "success"
+        return {
+            "type": "manifest",
+            "urn": urn,
+            "region": "US",
+            "status": status,
+            "progress": "complete",
+            "derivatives": [self._derivative(urn, translation.output_format, status)],
+        }
+
+    def notify_finished(self, urn: str) -> None:
+        """Posts `extraction.finished` to the hooks registered for the workflow the URN was submitted with."""
+        manifest = self.manifest(urn)
+        with self.state.lock:
+            translation = self.state.translations.get(urn)
+            callback_urls = list(self.state.hooks.get(translation.workflow, ())) if translation else []
+        for callback_url in callback_urls:
+            workflow = translation.workflow
+            body = {
+                "version": "1.0.0",
+                "resourceUrn": urn,
+                "hook": {"system": "derivative", "event": "extraction.finished", "scope": {"workflow": workflow}},
+                "payload": {"URN": urn, "WorkflowId": workflow, "Status": manifest["status"]},
+            }
+            request = urllib.request.Request(
+                callback_url, json.dumps(body).encode(), {"Content-Type": "application/json"}, method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except OSError:
+                continue  # like APS, give up on receivers that are down; the client polls as a fallback
+            with self.state.lock:
+                self.state.callbacks_sent += 1
+
+    def _derivative(self, urn: str, output_format: str, status: str) -> dict:
+        mime = "application/autodesk-svf2" if output_format == "svf2" else "application/autodesk-svf"
+
+        def viewable(index: int, role: str, name: str) -> dict:
+            guid = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{urn}/{index}"))
+            return {
+                "guid": guid,
+                "type": "geometry",
+                "role": role,
+                "name": name,
+                "status": status,
+                "progress": "complete",
+                "viewableID": guid,
+                "children": [{"guid": f"{guid}-graphics", "type": "resource", "role": "graphics", "mime": mime}],
+            }
+
+        children = [viewable(0, "3d", "{3D}")]
+        children += [viewable(i, "2d", f"Sheet {i}") for i in range(1, self.config.sheets + 1)]
+        return {
+            "outputType": output_format,
+            "status": status,
+            "progress": "complete",
+            "name": "model",
+            "hasThumbnail": "false",
+            "children": children,
+        }
+
+
+    def objects(self, urn: str, guid: str) -> list[dict]:
+        """The property collection of a view: a root, one node per category and `objects_per_view` leaves."""
+        categories = ["Walls", "Doors", "Windows", "Floors"]
+        objects = [{"objectid": 1, "name": "Model", "externalId": f"{guid}-root", "properties": {}}]
+        objects += [
+            {"objectid": 2 + i, "name": name, "externalId": f"{guid}-{name}", "properties": {}}
+            for i, name in enumerate(categories)
+        ]
+        first_leaf = 2 + len(categories)
+        for i in range(self.config.objects_per_view):
+            category = categories[i % len(categories)]
+            objects.append(
+                {
+                    "objectid": first_leaf + i,
+                    "name": f"{category[:-1]} [{1000 + i}]",
+                    "externalId": f"{guid}-{i}",
+                    "properties": {
+                        "Identity Data": {"Category": category, "Mark": str(i)},
+                        "Dimensions": {"Length": f"{1000 + i * 10} mm", "Area": round(2.5 + i * 0.1, 3)},
+                        "Materials": ["Concrete", "Steel"] if i % 2 else "Concrete",
+                    },
+                }
+            )
+        return objects
+
+    def object_tree(self, urn: str, guid: str) -> dict:
+        categories = {}
+        for obj in self.objects(urn, guid)[1:]:
+            category = obj["properties"].get("Identity Data", {}).get("Category")
+            if category is None:
+                categories[obj["name"]] = {"objectid": obj["objectid"], "name": obj["name"], "objects": []}
+            else:
+                categories[category]["objects"].append({"objectid": obj["objectid"], "name": obj["name"]})
+        return {"objectid": 1, "name": "Model", "objects": list(categories.values())}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients reuse connections
+    fake: FakeAPSServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict | None = None, headers: dict | None = None) -> None:
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _json_body(self) -> dict:
+        return json.loads(self._read_body() or b"{}")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        for route_method, name, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            self._read_body()
+            self._send(404, {"reason": "Route not found"})
+            return
+
+        config, state = self.fake.config, self.fake.state
+        with state.lock:
+            state.requests[(method, name)] += 1
+        if name != "s3_put":
+            if config.latency:
+                time.sleep(config.latency)
+            if config.error_rate and random.random() < config.error_rate:
+                self._read_body()
+                status = random.choice(config.error_statuses)
+                self._send(status, {"reason": "Injected error"}, {"Retry-After": str(config.retry_after)})
+                return
+        if name not in ["token", "s3_put"] and not self._authorized():
+            self._read_body()
+            self._send(401, {"developerMessage": "The token is not valid or has expired."})
+            return
+        getattr(self, f"_{name}")(query=parse_qs(url.query), **match.groupdict())
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    # Auth
+    def _authorized(self) -> bool:
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        with self.fake.state.lock:
+            expires_at = self.fake.state.tokens.get(token)
+        return expires_at is not None and time.monotonic() < expires_at
+
+    def _token(self, query):
+        self._read_body()
+        token, lifetime = f"fake-{uuid.uuid4().hex}", self.fake.config.token_lifetime
+        with self.fake.state.lock:
+            self.fake.state.tokens[token] = time.monotonic() + lifetime
+        self._send(200, {"access_token": token, "token_type": "Bearer", "expires_in": int(lifetime)})
+
+    # OSS
+    def _create_bucket(self, query):
+        bucket = self._json_body()["bucketKey"]
+        state = self.fake.state
+        with state.lock:
+            exists = bucket in state.buckets
+            state.buckets.add(bucket)
+        if exists:
+            self._send(409, {"reason": "Bucket already exists"})
+        else:
+            self._send(200, {"bucketKey": bucket, "policyKey": "transient"})
+
+    def _bucket_missing(self, bucket: str) -> bool:
+        with self.fake.state.lock:
+            missing = bucket not in self.fake.state.buckets
+        if missing:
+            self._send(404, {"reason": "Bucket not found"})
+        return missing
+
+    def _object_details(self, query, bucket, key):
+        self._read_body()
+        if self._bucket_missing(bucket):
+            return
+        with self.fake.state.lock:
+            size = self.fake.state.objects.get((bucket, key))
+        if size is None:
+            self._send(404, {"reason": "Object not found"})
+        else:
+            self._send(200, {"bucketKey": bucket, "objectKey": key, "objectId": _object_id(bucket, key), "size": size})
+
+    def _presign(self, query, bucket, key):
+        self._read_body()
+        if self._bucket_missing(bucket):
+            return
+        parts = int(query.get("parts", ["1"])[0])
+        first_part = int(query.get("firstPart", ["1"])[0])
+        upload_key = query.get("uploadKey", [uuid.uuid4().hex])[0]
+        minutes = float(query.get("minutesExpiration", ["2"])[0])
+        expires_in = minutes * self.fake.config.seconds_per_expiration_minute
+        with self.fake.state.lock:
+            self.fake.state.uploads.setdefault(upload_key, {})
+        # Like S3 signatures, the expiry is part of the URL: a URL past it is refused with 403
+        expires = time.time() + expires_in
+        urls = [
+            f"{self.fake.base_url}/s3/{upload_key}/{part}?expires={expires}"
+            for part in range(first_part, first_part + parts)
+        ]
+        expiration = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expires))
+        self._send(200, {"uploadKey": upload_key, "urls": urls, "uploadExpiration": expiration})
+
+    def _s3_put(self, query, upload_key, part):
+        expired = time.time() > float(query.get("expires", ["inf"])[0])
+        remaining = int(self.headers.get("Content-Length", 0))
+        bandwidth = self.fake.config.bandwidth
+        received = 0
+        started = time.monotonic()
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            received += len(chunk)
+            if bandwidth:
+                # Throttle this connection to `bandwidth` bytes/s
+                ahead = received / bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        state = self.fake.state
+        if expired:
+            self._send(403, {"reason": "Request has expired"})
+            return
+        with state.lock:
+            if upload_key not in state.uploads:
+                self._send(403, {"reason": "Unknown upload"})
+                return
+            state.uploads[upload_key][int(part)] = received
+            state.bytes_received += received
+        self._send(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def _finalize(self, query, bucket, key):
+        body = self._json_body()
+        state = self.fake.state
+        with state.lock:
+            parts = state.uploads.pop(body.get("uploadKey"), None)
+            if parts is not None:
+                state.objects[(bucket, key)] = sum(parts.values())
+        if parts is None:
+            self._send(400, {"reason": "Unknown uploadKey"})
+            return
+        self._send(200, {"bucketKey": bucket, "objectKey": key, "objectId": _object_id(bucket, key), "size": sum(parts.values())})
+
+    # Model Derivative
+    def _job(self, query):
+        body = self._json_body()
+        urn = body["input"]["urn"]
+        output_format = body["output"]["formats"][0]["type"]
+        force = self.headers.get("x-ads-force", "").lower() == "true"
+        fake = self.fake
+        manifest = fake.manifest(urn)
+        if manifest is not None and not force and manifest["status"] != "failed":
+            self._send(200, {"result": "success", "urn": urn})
+            return
+        workflow = body.get("misc", {}).get("workflow")
+        with fake.state.lock:
+            fake.state.translations[urn] = _Translation(
+                time.monotonic(), output_format, random.random() < fake.config.translation_failure_rate, workflow
+            )
+        self._send(200, {"result": "created", "urn": urn})
+        if workflow:
+            timer = threading.Timer(fake.config.translation_duration, fake.notify_finished, (urn,))
+            timer.daemon = True
+            timer.start()
+
+    def _manifest(self, query, urn):
+        self._read_body()
+        manifest = self.fake.manifest(urn)
+        if manifest is None:
+            self._send(404, {"diagnostic": "Manifest not found"})
+        else:
+            self._send(200, manifest)
+
+    def _view_guids(self, urn: str) -> list[str] | None:
+        """Guids of the views of a successfully translated URN, None if there is nothing to query (yet)."""
+        manifest = self.fake.manifest(urn)
+        if manifest is None or manifest["status"] != "success":
+            return None
+        return [viewable["guid"] for viewable in manifest["derivatives"][0]["children"]]
+
+    def _metadata(self, query, urn):
+        self._read_body()
+        manifest = self.fake.manifest(urn)
+        if self._view_guids(urn) is None:
+            self._send(404, {"diagnostic": "Translation not finished"})
+            return
+        views = [
+            {"name": viewable["name"], "role": viewable["role"], "guid": viewable["guid"]}
+            for viewable in manifest["derivatives"][0]["children"]
+        ]
+        self._send(200, {"data": {"type": "metadata", "metadata": views}})
+
+    def _view_ready(self, urn: str, guid: str) -> bool:
+        """Answers 404 for unknown views and 202 the first time a view is asked for (APS extracts lazily)."""
+        guids = self._view_guids(urn)
+        if guids is None or guid not in guids:
+            self._send(404, {"diagnostic": "View not found"})
+            return False
+        state = self.fake.state
+        with state.lock:
+            first = (urn, guid) not in state.extracted_views
+            state.extracted_views.add((urn, guid))
+        if first:
+            self._send(202, {"result": "success"})
+            return False
+        return True
+
+    def _too_large(self, query) -> bool:
+        config = self.fake.config
+        forceget = query.get("forceget", ["false"])[0] == "true"
+        limit = config.max_objects_with_forceget if forceget else config.max_objects_without_forceget
+        if config.objects_per_view > limit:
+            self._send(413, {"diagnostic": "Please use the 'forceget' parameter to force querying the data."})
+            return True
+        return False
+
+    def _object_tree(self, query, urn, guid):
+        self._read_body()
+        if self._view_ready(urn, guid) and not self._too_large(query):
+            self._send(200, {"data": {"type": "objects", "objects": [self.fake.object_tree(urn, guid)]}})
+
+    def _properties(self, query, urn, guid):
+        self._read_body()
+        if self._view_ready(urn, guid) and not self._too_large(query):
+            self._send(200, {"data": {"type": "properties", "collection": self.fake.objects(urn, guid)}})
+
+    def _properties_query(self, query, urn, guid):
+        pagination = self._json_body().get("pagination", {})
+        if not self._view_ready(urn, guid):
+            return
+        offset, limit = int(pagination.get("offset", 0)), int(pagination.get("limit", 20))
+        objects = self.fake.objects(urn, guid)
+        self._send(
+            200,
+            {
+                "pagination": {"offset": offset, "limit": limit, "totalResults": len(objects)},
+                "data": {"type": "properties", "collection": objects[offset:offset + limit]},
+            },
+        )
+
+    # Webhooks
+    def _webhook(self, query):
+        body = self._json_body()
+        callback_url, workflow = body.get("callbackUrl"), body.get("scope", {}).get("workflow")
+        if not callback_url or not workflow:
+            self._send(400, {"reason": "callbackUrl and scope.workflow are required"})
+            return
+        state = self.fake.state
+        with state.lock:
+            callback_urls = state.hooks.setdefault(workflow, set())
+            exists = callback_url in callback_urls
+            callback_urls.add(callback_url)
+        if exists:
+            self._send(409, {"reason": "Hook already exists"})
+        else:
+            self._send(201, headers={"Location": f"/hooks/{uuid.uuid4().hex}"})
+
+
+def _object_id(bucket: str, key: str) -> str:
+    return f"urn:adsk.objects:os.object:{bucket}/{key}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the APS endpoints used by tools.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes/s per upload connection")
+    parser.add_argument("--translation-duration", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = FakeAPSConfig(
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        translation_duration=args.translation_duration,
+        error_rate=args.error_rate,
+    )
+    server = FakeAPSServer(config, args.host, args.port).start()
+    print(f"Fake APS listening on {server.base_url} (set APS_BASE_URL to use it), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
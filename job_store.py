@@ -0,0 +1,172 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+# SQLite file recording background jobs. It lives next to the app by default, as it has to survive restarts.
+JOB_STORE_PATH = os.environ.get("APS_JOB_STORE_PATH", str(Path(__file__).parent / "aps_jobs.sqlite3"))
+# A job owned by a process on another host, which cannot be checked directly, is considered abandoned once its owner
+# has not updated it for this long.
+JOB_STALE_AFTER = float(os.environ.get("APS_JOB_STALE_AFTER", "300"))
+# Finished jobs are kept this long, for inspection.
+JOB_STORE_RETENTION = 24 * 60 * 60
+
+# Identifies this process as the owner of the jobs it runs: host:pid for the liveness check, plus a random id,
+# as a restarted container often gets the same hostname and PID as the process it replaces.
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+FINISHED_STAGES = ("done", "failed")
+
+
+@dataclass(frozen=True)
+class StoredJob:
+    id: str
+    name: str
+    client_id: str
+    content_hash: str
+    output_format: str
+    urn: str | None
+    stage: str
+    detail: str
+    error: str | None
+    owner: str
+    created_at: float
+    updated_at: float
+    finished_at: float | None
+
+
+def _owner_alive(owner: str) -> bool | None:
+    """Whether the owning process still runs, or None if that cannot be checked (it runs on another host)."""
+    host, _, rest = owner.partition(":")
+    if host != socket.gethostname():
+        return None
+    try:
+        pid = int(rest.split(":")[0])
+    except ValueError:
+        return None
+    if pid == os.getpid():
+        return False  # Our PID, but not our OWNER (checked by the caller): a restart reused the PID
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """Durable record of background jobs (jobs.py), so unfinished translations can be picked up after a restart."""
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    client_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    urn TEXT,
+                    stage TEXT NOT NULL,
+                    detail TEXT NOT NULL,
+                    error TEXT,
+                    owner TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def save(
+        self,
+        job_id: str,
+        name: str,
+        client_id: str,
+        content_hash: str,
+        output_format: str,
+        urn: str | None,
+        stage: str,
+        detail: str,
+        error: str | None,
+        created_at: float,
+        finished_at: float | None,
+    ) -> None:
+        """Inserts or updates the job, owned by this process."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id, name, client_id, content_hash, output_format, urn, stage, detail, error,
+                    OWNER, created_at, time.time(), finished_at,
+                ),
+            )
+
+    def get(self, job_id: str) -> StoredJob | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return StoredJob(*row) if row else None
+
+    def unfinished(self) -> list[StoredJob]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE stage NOT IN (?, ?) ORDER BY created_at", FINISHED_STAGES
+            ).fetchall()
+        return [StoredJob(*row) for row in rows]
+
+    def abandoned(self) -> list[StoredJob]:
+        """Unfinished jobs whose owner process is gone. Owners on this host are checked directly, so a long upload
+        that reports no progress is not taken away from its (live) owner; jobs of owners on other hosts count as
+        abandoned once they have not reported for JOB_STALE_AFTER seconds.
+        """
+        stale_before = time.time() - JOB_STALE_AFTER
+        abandoned = []
+        for job in self.unfinished():
+            if job.owner == OWNER:
+                continue
+            alive = _owner_alive(job.owner)
+            if alive is None:
+                alive = job.updated_at >= stale_before
+            if not alive:
+                abandoned.append(job)
+        return abandoned
+
+    def claim(self, job: StoredJob) -> bool:
+        """Takes over an abandoned job. Only one process wins when several try to claim the same job."""
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "UPDATE jobs SET owner = ?, updated_at = ? WHERE id = ? AND owner = ? AND updated_at = ?",
+                (OWNER, time.time(), job.id, job.owner, job.updated_at),
+            ).rowcount == 1
+
+    def evict_finished(self, older_than: float = JOB_STORE_RETENTION) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at <= ?", (time.time() - older_than,)
+            ).rowcount
+
+
+_job_store: JobStore | None = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """Returns the process-wide store; old finished jobs are evicted when it is first opened."""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+            _job_store.evict_finished()
+        return _job_store
@@ -0,0 +1,210 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from job_store import JobStore, get_job_store
+from result_cache import get_result_cache
+from tools import process_cad_file, wait_for_translation, TokenProvider, OUTPUT_FORMAT
+from upload_source import FileContent, UploadSource
+
+# Number of CAD files processed (uploaded + translated) at the same time.
+JOB_WORKERS = int(os.environ.get("APS_JOB_WORKERS", "4"))
+# Finished jobs are kept this long so later view renders can still pick up their result.
+JOB_RETENTION = 60 * 60
+
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    key: tuple[str, str, str]
+    stage: str = "queued"  # queued -> hashing -> uploading -> translating -> done | failed
+    detail: str = ""
+    urn: str | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in ["done", "failed"]
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Blocks until the job finished or `timeout` passed; returns whether it finished."""
+        return self._done.wait(timeout)
+
+
+class JobManager:
+    """Runs process_cad_file on a bounded worker pool so callers get a job id back immediately.
+    Jobs are keyed by (client_id, content hash, output format): submitting a file that is already being
+    processed returns the running job instead of starting another one.
+    With a `store`, every job is recorded there so `resume` can pick up translations left by a stopped process.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, store: JobStore | None = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aps-job")
+        self._store = store
+        self._jobs: dict[str, Job] = {}
+        self._jobs_by_key: dict[tuple[str, str, str], str] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        name: str,
+        file_content: FileContent,
+        client_id: str,
+        client_secret: str,
+        output_format: str = OUTPUT_FORMAT,
+    ) -> Job:
+        # Hash the caller's file in place first (only a stream that cannot be read twice is copied for that), so
+        # refreshing the view of a running job finds it without copying the whole file again.
+        probe = UploadSource(file_content)
+        try:
+            key = (client_id, probe.sha256(), output_format)
+            with self._lock:
+                existing = self._live_job(key)
+            if existing is not None:
+                probe.close()
+                return existing
+            # Take a private copy: the caller's file (e.g. a vkt.File stream) is gone once the view has returned.
+            if probe.spooled:
+                source = probe
+            else:
+                with probe.open_part() as reader:
+                    source = UploadSource(reader, spool=True)
+                probe.close()
+        except BaseException:
+            probe.close()
+            raise
+        with self._lock:
+            # Another render of the same file may have started the job while this one was copying it
+            existing = self._live_job(key)
+            if existing is not None:
+                source.close()
+                return existing
+            job = Job(id=uuid.uuid4().hex, name=name, key=key)
+            self._jobs[job.id] = job
+            self._jobs_by_key[key] = job.id
+        self._persist(job)
+        self._executor.submit(self._run, job, client_secret, source)
+        return job
+
+    def _live_job(self, key: tuple[str, str, str]) -> Job | None:
+        """The job for `key` unless there is none or it failed. Call with the lock held."""
+        self._prune()
+        existing = self._jobs.get(self._jobs_by_key.get(key, ""))
+        return existing if existing is not None and existing.stage != "failed" else None
+
+    def resume(self, client_id: str, client_secret: str) -> list[Job]:
+        """Re-attaches to the abandoned jobs of `client_id` in the store, e.g. after a restart or deploy.
+        Jobs whose translation was submitted are polled until they finish; the others failed with their process,
+        as their upload cannot be continued without the file.
+        """
+        if self._store is None:
+            return []
+        resumed = []
+        for stored in self._store.abandoned():
+            if stored.client_id != client_id or not self._store.claim(stored):
+                continue
+            job = Job(
+                id=stored.id,
+                name=stored.name,
+                key=(stored.client_id, stored.content_hash, stored.output_format),
+                stage=stored.stage,
+                detail=stored.detail,
+                urn=stored.urn,
+                created_at=stored.created_at,
+            )
+            with self._lock:
+                self._jobs[job.id] = job
+                self._jobs_by_key.setdefault(job.key, job.id)
+            if job.urn is None:
+                job.stage, job.error = "failed", "Interrupted before the translation was submitted"
+                job.finished_at = time.time()
+                job._done.set()
+                self._persist(job)
+            else:
+                self._executor.submit(self._run, job, client_secret, None)
+            resumed.append(job)
+        return resumed
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, client_secret: str, source: UploadSource | None) -> None:
+        """Processes `source`, or with no source, waits for the already submitted translation of a resumed job."""
+        client_id, content_hash, output_format = job.key
+
+        def on_progress(stage: str, detail: str) -> None:
+            if stage == "submitted":
+                job.urn = detail
+            else:
+                job.stage, job.detail = stage, detail
+            self._persist(job)
+
+        try:
+            # Resolved per request: a job can outlive the token that was current when it started
+            token = TokenProvider(client_id=client_id, client_secret=client_secret)
+            if source is not None:
+                job.urn = process_cad_file(
+                    object_name=job.name,
+                    file_content=source,
+                    token=token,
+                    client_id=client_id,
+                    output_format=output_format,
+                    on_progress=on_progress,
+                )
+            else:
+                wait_for_translation(token, job.urn, on_progress=on_progress)
+                get_result_cache().put(client_id, content_hash, output_format, job.urn)
+            job.stage = "done"
+        except Exception as e:
+            job.stage, job.error = "failed", str(e)
+        finally:
+            if source is not None:
+                source.close()
+            job.finished_at = time.time()
+            self._persist(job)
+            job._done.set()
+
+    def _persist(self, job: Job) -> None:
+        if self._store is None:
+            return
+        client_id, content_hash, output_format = job.key
+        try:
+            self._store.save(
+                job.id, job.name, client_id, content_hash, output_format, job.urn,
+                job.stage, job.detail, job.error, job.created_at, job.finished_at,
+            )
+        except sqlite3.Error:
+            pass  # The store only helps after a restart; it must never break the running job
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
+                if self._jobs_by_key.get(job.key) == job_id:
+                    del self._jobs_by_key[job.key]
+
+
+_job_manager: JobManager | None = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(store=get_job_store())
+            # Pick up translations a previous process left unfinished
+            client_id, client_secret = os.environ.get("CLIENT_ID"), os.environ.get("CLIENT_SECRET")
+            if client_id and client_secret:
+                _job_manager.resume(client_id, client_secret)
+        return _job_manager
@@ -0,0 +1,175 @@
+"""Model Derivative manifests parsed into an indexed structure.
+
+A manifest is a tree: derivatives (one per output format) hold geometry nodes (the viewables: 3D views and 2D
+sheets), which hold resources (graphics, property databases, thumbnails). `Manifest.parse` flattens this into
+derivatives -> viewables -> resources with a guid index, so a sheet can be looked up without walking the tree.
+Finished manifests are kept per URN in a small in-process cache; they do not change once translation is done.
+"""
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# Manifests kept in the per-URN cache.
+MANIFEST_CACHE_SIZE = 256
+
+
+@dataclass(frozen=True)
+class Resource:
+    guid: str
+    role: str  # e.g. "graphics", "Autodesk.CloudPlatform.PropertyDatabase", "thumbnail"
+    mime: str | None = None
+    urn: str | None = None
+
+
+@dataclass(frozen=True)
+class Viewable:
+    guid: str
+    name: str
+    role: str  # "2d" (sheet) or "3d" (view)
+    status: str
+    output_type: str
+    resources: tuple[Resource, ...] = ()
+
+    @property
+    def is_sheet(self) -> bool:
+        return self.role == "2d"
+
+
+@dataclass(frozen=True)
+class Derivative:
+    output_type: str
+    status: str
+    progress: str
+    name: str | None
+    viewables: tuple[Viewable, ...] = ()
+
+
+@dataclass(frozen=True)
+class Manifest:
+    urn: str
+    status: str
+    progress: str
+    derivatives: tuple[Derivative, ...] = ()
+    _by_guid: dict[str, Viewable] = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def parse(cls, data: dict) -> "Manifest":
+        derivatives = []
+        by_guid = {}
+        for derivative in data.get("derivatives", []):
+            output_type = derivative.get("outputType", "")
+            viewables = tuple(_viewables(derivative.get("children", []), output_type))
+            for viewable in viewables:
+                by_guid.setdefault(viewable.guid, viewable)
+            derivatives.append(
+                Derivative(
+                    output_type=output_type,
+                    status=derivative.get("status", ""),
+                    progress=derivative.get("progress", ""),
+                    name=derivative.get("name"),
+                    viewables=viewables,
+                )
+            )
+        return cls(
+            urn=data.get("urn", ""),
+            status=data.get("status", ""),
+            progress=data.get("progress", ""),
+            derivatives=tuple(derivatives),
+            _by_guid=by_guid,
+        )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ["success", "failed", "timeout"]
+
+    def viewables(self, output_types: list[str] | None = None) -> list[Viewable]:
+        """All viewables in manifest order, optionally only those of the given output formats."""
+        return [
+            viewable
+            for derivative in self.derivatives
+            if output_types is None or derivative.output_type in output_types
+            for viewable in derivative.viewables
+        ]
+
+    def sheets(self, output_types: list[str] | None = None) -> list[Viewable]:
+        return [viewable for viewable in self.viewables(output_types) if viewable.is_sheet]
+
+    def viewable(self, guid: str) -> Viewable | None:
+        return self._by_guid.get(guid)
+
+    def find(self, name_or_guid: str, output_types: list[str] | None = None) -> Viewable | None:
+        """The viewable with this guid, or else the first one with this (case-insensitive) name."""
+        viewable = self._by_guid.get(name_or_guid)
+        if viewable is not None and (output_types is None or viewable.output_type in output_types):
+            return viewable
+        name = name_or_guid.strip().lower()
+        return next((v for v in self.viewables(output_types) if v.name.lower() == name), None)
+
+
+def _viewables(nodes: list[dict], output_type: str) -> list[Viewable]:
+    """Geometry nodes anywhere below `nodes` (they can sit in folders), each with the resources below it."""
+    viewables = []
+    for node in nodes:
+        if node.get("type") == "geometry" and node.get("role") in ["2d", "3d"]:
+            viewables.append(
+                Viewable(
+                    guid=node["guid"],
+                    name=node.get("name", ""),
+                    role=node["role"],
+                    status=node.get("status", ""),
+                    output_type=output_type,
+                    resources=tuple(_resources(node.get("children", []))),
+                )
+            )
+        else:
+            viewables += _viewables(node.get("children", []), output_type)
+    return viewables
+
+
+def _resources(nodes: list[dict]) -> list[Resource]:
+    resources = []
+    for node in nodes:
+        if node.get("type") == "resource":
+            resources.append(
+                Resource(guid=node.get("guid", ""), role=node.get("role", ""), mime=node.get("mime"), urn=node.get("urn"))
+            )
+        resources += _resources(node.get("children", []))
+    return resources
+
+
+class ManifestCache:
+    """LRU map of URN -> finished Manifest."""
+
+    def __init__(self, max_size: int = MANIFEST_CACHE_SIZE):
+        self.max_size = max_size
+        self._manifests: OrderedDict[str, Manifest] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, urn: str) -> Manifest | None:
+        with self._lock:
+            manifest = self._manifests.get(urn)
+            if manifest is not None:
+                self._manifests.move_to_end(urn)
+            return manifest
+
+    def put(self, urn: str, manifest: Manifest) -> None:
+        """Caches `manifest` if it is finished; manifests of running translations still change."""
+        if not manifest.finished:
+            return
+        with self._lock:
+            self._manifests[urn] = manifest
+            self._manifests.move_to_end(urn)
+            while len(self._manifests) > self.max_size:
+                self._manifests.popitem(last=False)
+
+    def delete(self, urn: str) -> None:
+        with self._lock:
+            self._manifests.pop(urn, None)
+
+
+_manifest_cache = ManifestCache()
+
+
+def get_manifest_cache() -> ManifestCache:
+    return _manifest_cache
@@ -0,0 +1,335 @@
+"""Model properties of a translated URN, extracted once from Model Derivative into a local SQLite store.
+
+For every view (metadata guid) the object tree and the properties of all objects are fetched and normalized into
+one row per (object, category, property), indexed on object id, category and property name. Later queries run
+against the local store instead of APS:
+
+    extract_properties(token, urn)
+    walls = get_property_store().query(urn, category="Identity Data", name="Category", value="Walls")
+
+APS extracts properties lazily and answers 202 until they are ready; those requests are repeated on a PollSchedule.
+Large models are refused (413). Their object tree is then fetched with `forceget=true`, their properties are paged
+through the `properties:query` endpoint.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import requests #type: ignore
+
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+import tools
+import telemetry
+
+# SQLite file holding extracted properties (APS_PROPERTIES_PATH); defaults to the app directory.
+PROPERTIES_PATH = os.environ.get(
+    "APS_PROPERTIES_PATH", str(Path(__file__).parent / "aps_properties.sqlite3")
+)
+# Objects per properties:query page when a model is too large to be fetched in one response.
+PROPERTIES_PAGE_SIZE = 1000
+# How long to wait for APS to extract the properties of one view.
+EXTRACTION_TIMEOUT = 10 * 60
+
+_NUMBER_PATTERN = re.compile(r"^\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)")
+
+
+@dataclass(frozen=True)
+class PropertyValue:
+    objectid: int
+    category: str
+    name: str
+    value: str
+    numeric: float | None  # The value as a number (e.g. 1200 for "1200 mm"), for range queries
+
+
+class PropertyStore:
+    """Normalized object trees and properties per (urn, view guid).
+    Queries usually span all views of a URN, so apart from the per-view index (also used to clear a view) the
+    property indexes start with the URN and the column filtered on: objectid, category/name/value or name/value.
+    """
+
+    def __init__(self, path: str = PROPERTIES_PATH):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS views (
+                    urn TEXT NOT NULL,
+                    guid TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    extracted_at REAL NOT NULL,
+                    PRIMARY KEY (urn, guid)
+                );
+                CREATE TABLE IF NOT EXISTS objects (
+                    urn TEXT NOT NULL,
+                    guid TEXT NOT NULL,
+                    objectid INTEGER NOT NULL,
+                    parent_id INTEGER,
+                    name TEXT NOT NULL,
+                    external_id TEXT,
+                    PRIMARY KEY (urn, guid, objectid)
+                );
+                CREATE TABLE IF NOT EXISTS properties (
+                    urn TEXT NOT NULL,
+                    guid TEXT NOT NULL,
+                    objectid INTEGER NOT NULL,
+                    category TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value TEXT,
+                    numeric REAL
+                );
+                CREATE INDEX IF NOT EXISTS objects_parent ON objects (urn, guid, parent_id);
+                DROP INDEX IF EXISTS properties_objectid;
+                DROP INDEX IF EXISTS properties_category;
+                DROP INDEX IF EXISTS properties_name;
+                CREATE INDEX IF NOT EXISTS properties_by_view ON properties (urn, guid, objectid);
+                CREATE INDEX IF NOT EXISTS properties_by_objectid ON properties (urn, objectid);
+                CREATE INDEX IF NOT EXISTS properties_by_category ON properties (urn, category, name, value);
+                CREATE INDEX IF NOT EXISTS properties_by_name ON properties (urn, name, value);"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def views(self, urn: str) -> list[dict]:
+        """The views of `urn` whose properties have been extracted completely."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT guid, name, role, extracted_at FROM views WHERE urn = ? ORDER BY name", (urn,)
+            ).fetchall()
+        return [dict(zip(["guid", "name", "role", "extracted_at"], row)) for row in rows]
+
+    def has_view(self, urn: str, guid: str) -> bool:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM views WHERE urn = ? AND guid = ?", (urn, guid)).fetchone() is not None
+
+    def clear_view(self, urn: str, guid: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            for table in ["views", "objects", "properties"]:
+                conn.execute(f"DELETE FROM {table} WHERE urn = ? AND guid = ?", (urn, guid))
+
+    def add_objects(self, urn: str, guid: str, tree: dict) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, NULL)",
+                ((urn, guid, objectid, parent_id, name) for objectid, parent_id, name in _walk_tree(tree)),
+            )
+
+    def add_properties(self, urn: str, guid: str, collection: list[dict]) -> int:
+        """Normalizes and inserts one batch of property objects; returns the number of objects."""
+        rows = (
+            (urn, guid, obj["objectid"], category, name, value, numeric)
+            for obj in collection
+            for category, name, value, numeric in _flatten(obj.get("properties", {}))
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT INTO properties VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            # Objects missing from the tree (e.g. when it was too large to fetch) are added without a parent
+            conn.executemany(
+                "INSERT INTO objects VALUES (?, ?, ?, NULL, ?, ?) "
+                "ON CONFLICT (urn, guid, objectid) DO UPDATE SET external_id = excluded.external_id",
+                ((urn, guid, obj["objectid"], obj.get("name", ""), obj.get("externalId")) for obj in collection),
+            )
+        return len(collection)
+
+    def finish_view(self, urn: str, guid: str, name: str, role: str) -> None:
+        """Marks the view as completely extracted, so it is served from the store from now on."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO views VALUES (?, ?, ?, ?, ?)", (urn, guid, name, role, time.time()))
+
+    def query(
+        self,
+        urn: str,
+        guid: str | None = None,
+        objectid: int | None = None,
+        category: str | None = None,
+        name: str | None = None,
+        value: str | None = None,
+        limit: int | None = None,
+    ) -> list[PropertyValue]:
+        """Property rows matching all given filters."""
+        conditions, args = ["urn = ?"], [urn]
+        filters = [("guid", guid), ("objectid", objectid), ("category", category), ("name", name), ("value", value)]
+        for column, arg in filters:
+            if arg is not None:
+                conditions.append(f"{column} = ?")
+                args.append(arg)
+        sql = f"SELECT objectid, category, name, value, numeric FROM properties WHERE {' AND '.join(conditions)}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with closing(self._connect()) as conn:
+            return [PropertyValue(*row) for row in conn.execute(sql, args)]
+
+    def object_properties(self, urn: str, guid: str, objectid: int) -> dict[str, dict[str, str]]:
+        """All properties of one object as {category: {name: value}}."""
+        grouped: dict[str, dict[str, str]] = {}
+        for row in self.query(urn, guid, objectid=objectid):
+            grouped.setdefault(row.category, {})[row.name] = row.value
+        return grouped
+
+    def children(self, urn: str, guid: str, parent_id: int | None = None) -> list[tuple[int, str]]:
+        """(objectid, name) of the objects directly below `parent_id`, or of the roots when it is None."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT objectid, name FROM objects WHERE urn = ? AND guid = ? AND parent_id IS ? ORDER BY objectid",
+                (urn, guid, parent_id),
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+
+def _walk_tree(tree: dict) -> Iterator[tuple[int, int | None, str]]:
+    """(objectid, parent id, name) of every node, iteratively, as trees of large models are deep."""
+    stack = [(node, None) for node in tree.get("objects", [])]
+    while stack:
+        node, parent_id = stack.pop()
+        yield node["objectid"], parent_id, node.get("name", "")
+        stack.extend((child, node["objectid"]) for child in node.get("objects", []))
+
+
+def _flatten(properties: dict) -> Iterator[tuple[str, str, str, float | None]]:
+    """(category, name, value, numeric value) per property; values outside a category get category ""."""
+    for key, value in properties.items():
+        if isinstance(value, dict):
+            for name, inner in value.items():
+                yield (key, name, *_normalize_value(inner))
+        else:
+            yield ("", key, *_normalize_value(value))
+
+
+def _normalize_value(value) -> tuple[str, float | None]:
+    if isinstance(value, bool):
+        return str(value).lower(), None
+    if isinstance(value, (int, float)):
+        return str(value), float(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value), None
+    text = "" if value is None else str(value)
+    match = _NUMBER_PATTERN.match(text)
+    return text, float(match.group(1)) if match else None
+
+
+def _get_extracted(token: str, url: str, endpoint: str, params: dict | None = None) -> requests.Response:
+    """GETs a metadata endpoint, repeating it while APS answers 202 (still extracting)."""
+    schedule = tools.PollSchedule(timeout=EXTRACTION_TIMEOUT)
+    while True:
+        response = tools.aps_request(
+            "GET", url, endpoint, params=params, headers={"Authorization": f"Bearer {token}"}, timeout=120
+        )
+        if response.status_code != 202:
+            return response
+        schedule.observe(None)
+        time.sleep(schedule.next_delay())
+
+
+def get_metadata_views(token: str, object_urn: str) -> list[dict]:
+    """The views ({name, role, guid}) whose object tree and properties can be queried."""
+    response = _get_extracted(token, f"{tools.MD_BASE_URL}/designdata/{object_urn}/metadata", "metadata")
+    response.raise_for_status()
+    return response.json()["data"]["metadata"]
+
+
+def get_object_tree(token: str, object_urn: str, guid: str) -> dict | None:
+    """The object tree of a view, or None if it is too large for APS to return even with forceget."""
+    url = f"{tools.MD_BASE_URL}/designdata/{object_urn}/metadata/{guid}"
+    response = _get_extracted(token, url, "object_tree")
+    if response.status_code == 413:
+        response = _get_extracted(token, url, "object_tree", {"forceget": "true"})
+        if response.status_code == 413:
+            return None
+    response.raise_for_status()
+    objects = response.json()["data"]["objects"]
+    return {"objects": objects}
+
+
+def iter_property_pages(token: str, object_urn: str, guid: str) -> Iterator[list[dict]]:
+    """The property collection of a view in batches: one batch if APS returns everything at once, otherwise
+    (413, too large) pages of PROPERTIES_PAGE_SIZE objects from properties:query. forceget is not used here, as
+    it would load the whole collection of a large model into memory as one JSON document.
+    """
+    url = f"{tools.MD_BASE_URL}/designdata/{object_urn}/metadata/{guid}/properties"
+    response = _get_extracted(token, url, "properties")
+    if response.status_code != 413:
+        response.raise_for_status()
+        yield response.json()["data"]["collection"]
+        return
+
+    offset = 0
+    while True:
+        schedule = tools.PollSchedule(timeout=EXTRACTION_TIMEOUT)
+        while True:
+            response = tools.aps_request(
+                "POST",
+                f"{url}:query",
+                "properties",
+                idempotent=True,
+                json={"pagination": {"offset": offset, "limit": PROPERTIES_PAGE_SIZE}},
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                timeout=120,
+            )
+            if response.status_code != 202:
+                break
+            schedule.observe(None)
+            time.sleep(schedule.next_delay())
+        response.raise_for_status()
+        body = response.json()
+        collection = body["data"]["collection"]
+        if collection:
+            yield collection
+        offset += len(collection)
+        if not collection or offset >= body.get("pagination", {}).get("totalResults", 0):
+            return
+
+
+def extract_properties(
+    token: str, object_urn: str, guids: list[str] | None = None, refresh: bool = False
+) -> list[str]:
+    """Fetches object trees and properties of a translated URN into the property store and returns the view
+    guids that are now available. By default all 3D views are extracted (all views if the model has none).
+    Views already in the store are skipped unless `refresh` is set.
+    """
+    store = get_property_store()
+    if guids is None and not refresh:
+        stored = store.views(object_urn)
+        if stored:
+            return [view["guid"] for view in stored]
+    views = get_metadata_views(token, object_urn)
+    if guids is not None:
+        views = [view for view in views if view["guid"] in guids]
+    elif any(view.get("role") == "3d" for view in views):
+        views = [view for view in views if view.get("role") == "3d"]
+
+    extracted = []
+    for view in views:
+        guid = view["guid"]
+        if refresh or not store.has_view(object_urn, guid):
+            with telemetry.span("properties", guid=guid) as properties_span:
+                store.clear_view(object_urn, guid)
+                tree = get_object_tree(token, object_urn, guid)
+                if tree is not None:
+                    store.add_objects(object_urn, guid, tree)
+                count = sum(
+                    store.add_properties(object_urn, guid, page) for page in iter_property_pages(token, object_urn, guid)
+                )
+                store.finish_view(object_urn, guid, view.get("name", ""), view.get("role", ""))
+                properties_span.set(objects=count)
+        extracted.append(guid)
+    return extracted
+
+
+_property_store: PropertyStore | None = None
+_property_store_lock = threading.Lock()
+
+
+def get_property_store() -> PropertyStore:
+    global _property_store
+    with _property_store_lock:
+        if _property_store is None:
+            _property_store = PropertyStore()
+        return _property_store
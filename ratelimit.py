@@ -0,0 +1,129 @@
+"""Client-side token-bucket rate limits per APS endpoint family (auth, OSS, MD, ...).
+
+Every APS request takes a token from its family's bucket first, so concurrent jobs stay just under the APS
+per-minute quotas instead of running into 429s. Limits are requests per minute, set through APS_RATE_LIMITS:
+
+    APS_RATE_LIMITS="auth:60,oss:500,md:300"
+
+A family with limit 0, or missing from the list, is not limited. By default the buckets are shared by the
+threads of one process. With APS_RATE_LIMIT_DIR set, they are kept in lock files in that directory instead
+and shared by every process on the machine that uses the same directory.
+"""
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; limits are then per process only
+    fcntl = None
+
+DEFAULT_RATE_LIMITS = "auth:60,oss:500,md:300,webhooks:60"
+RATE_LIMIT_DIR = os.environ.get("APS_RATE_LIMIT_DIR")
+# Seconds of quota that may be used in one burst, e.g. after an idle period.
+BURST_SECONDS = 10.0
+
+
+def parse_rate_limits(value: str) -> dict[str, float]:
+    limits = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        family, _, per_minute = entry.partition(":")
+        limits[family.strip()] = float(per_minute)
+    return limits
+
+
+class TokenBucket:
+    """Allows `per_minute` requests per minute on average, in bursts of at most `burst` requests."""
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = per_minute / 60
+        self.capacity = burst or max(1.0, self.rate * BURST_SECONDS)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill_and_take(self, tokens: float, updated: float, now: float) -> tuple[float, float]:
+        """Returns (new token count, seconds to wait); the wait is 0 if a token was taken."""
+        tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available and returns 0, otherwise returns how long to wait before retrying."""
+        with self._lock:
+            now = time.time()
+            self._tokens, wait = self._refill_and_take(self._tokens, self._updated, now)
+            self._updated = now
+            return wait
+
+    def acquire(self) -> float:
+        """Blocks until a token is taken; returns the seconds spent waiting."""
+        waited = 0.0
+        while wait := self.try_acquire():
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+
+class FileTokenBucket(TokenBucket):
+    """A TokenBucket whose state lives in a lock file, so all processes using the file share it."""
+
+    def __init__(self, path: str, per_minute: float, burst: float | None = None):
+        super().__init__(per_minute, burst)
+        self.path = path
+
+    def try_acquire(self) -> float:
+        with self._lock, open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            f.seek(0)
+            state = f.read().split()
+            now = time.time()
+            tokens, updated = (float(state[0]), float(state[1])) if len(state) == 2 else (self.capacity, now)
+            tokens, wait = self._refill_and_take(tokens, updated, now)
+            f.seek(0)
+            f.truncate()
+            f.write(f"{tokens} {now}")
+            return wait
+
+
+class RateLimiter:
+    def __init__(self, limits: dict[str, float], directory: str | None = None):
+        self.buckets: dict[str, TokenBucket] = {}
+        if directory and fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+        for family, per_minute in limits.items():
+            if per_minute <= 0:
+                continue
+            if directory and fcntl is not None:
+                self.buckets[family] = FileTokenBucket(os.path.join(directory, f"{family}.bucket"), per_minute)
+            else:
+                self.buckets[family] = TokenBucket(per_minute)
+
+    def try_acquire(self, family: str) -> float:
+        bucket = self.buckets.get(family)
+        return bucket.try_acquire() if bucket else 0.0
+
+    def acquire(self, family: str) -> float:
+        bucket = self.buckets.get(family)
+        return bucket.acquire() if bucket else 0.0
+
+
+_rate_limiter: RateLimiter | None = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            limits = parse_rate_limits(os.environ.get("APS_RATE_LIMITS", DEFAULT_RATE_LIMITS))
+            _rate_limiter = RateLimiter(limits, RATE_LIMIT_DIR)
+        return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter: RateLimiter | None) -> None:
+    """Replaces the process-wide limiter; None makes the next get_rate_limiter() read the environment again."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = rate_limiter
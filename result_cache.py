@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import threading
+
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+# SQLite file holding translated URNs, in the app directory unless APS_RESULT_CACHE_PATH says otherwise.
+RESULT_CACHE_PATH = os.environ.get(
+    "APS_RESULT_CACHE_PATH", str(Path(__file__).parent / "aps_result_cache.sqlite3")
+)
+# Matches the 24 h retention of the `transient` bucket policy the app uploads to.
+RESULT_CACHE_TTL = float(os.environ.get("APS_RESULT_CACHE_TTL", str(24 * 60 * 60)))
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    urn: str
+    status: str
+    translated_at: float
+
+
+class ResultCache:
+    """Persistent map of (client_id, content hash, output format) -> translated URN, expiring after `ttl` seconds."""
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, ttl: float = RESULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    client_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    urn TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    translated_at REAL NOT NULL,
+                    PRIMARY KEY (client_id, content_hash, output_format)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_translated_at ON results (translated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, client_id: str, content_hash: str, output_format: str) -> CachedResult | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT urn, status, translated_at FROM results "
+                "WHERE client_id = ? AND content_hash = ? AND output_format = ? AND translated_at > ?",
+                (client_id, content_hash, output_format, time.time() - self.ttl),
+            ).fetchone()
+        return CachedResult(*row) if row else None
+
+    def put(self, client_id: str, content_hash: str, output_format: str, urn: str, status: str = "success") -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (client_id, content_hash, output_format, urn, status, time.time()),
+            )
+
+    def delete(self, client_id: str, content_hash: str, output_format: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM results WHERE client_id = ? AND content_hash = ? AND output_format = ?",
+                (client_id, content_hash, output_format),
+            )
+
+    def evict_expired(self) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("DELETE FROM results WHERE translated_at <= ?", (time.time() - self.ttl,)).rowcount
+
+
+_result_cache: ResultCache | None = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Returns the process-wide cache; expired rows are evicted when it is first opened."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+            _result_cache.evict_expired()
+        return _result_cache
+
+
+def set_result_cache(cache: ResultCache | None) -> None:
+    """Replaces the process-wide cache, e.g. with one in a scratch file; None reopens the default on next use."""
+    global _result_cache
+    with _result_cache_lock:
+        _result_cache = cache
@@ -0,0 +1,198 @@
+"""Shared retry policy for APS calls.
+
+Transient failures (429, 5xx, connection errors) are retried with exponential backoff and full jitter, or
+after the delay the server asks for in Retry-After. Retries are idempotency-aware. Idempotent requests are
+retried on any transient failure. Other requests are only retried when the server rejected them without
+processing (429/503) or the connection was never made. Each endpoint has a retry budget, so retries can add
+at most `budget_ratio` extra load when APS is struggling instead of multiplying it.
+`RetryPolicy.call` drives blocking `requests` calls and `RetryPolicy.acall` async ones (aps_async.py).
+"""
+import os
+import time
+import asyncio
+import random
+import threading
+import requests #type: ignore
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("APS_RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.environ.get("APS_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.environ.get("APS_RETRY_MAX_DELAY", "30"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Statuses meaning the request was rejected before it was processed, so even non-idempotent calls can be resent.
+NOT_PROCESSED_STATUSES = {429, 503}
+# Exceptions of `requests` meaning no response was received, and those of them meaning no connection was made.
+TRANSPORT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+CONNECT_ERRORS = (requests.exceptions.ConnectTimeout,)
+
+
+class RetryBudget:
+    """Token bucket of retries: every request earns `ratio` of a retry, every retry spends one.
+    `reserve` retries are available up front, so a quiet endpoint can still ride out a short hiccup.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self.reserve * 10, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After in seconds; the header holds either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY,
+        budget_ratio: float = 0.2,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self._budgets: dict[str, RetryBudget] = {}
+        self._budgets_lock = threading.Lock()
+
+    def budget(self, endpoint: str) -> RetryBudget:
+        with self._budgets_lock:
+            return self._budgets.setdefault(endpoint, RetryBudget(self.budget_ratio))
+
+    def retry_delay(
+        self,
+        endpoint: str,
+        attempt: int,
+        idempotent: bool,
+        status: int | None = None,
+        retry_after: str | None = None,
+        connection_made: bool = True,
+    ) -> float | None:
+        """Seconds to wait before resending a failed attempt (1-based), or None if it should not be retried.
+        `status` is None when no response was received at all.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if status is not None and status not in RETRYABLE_STATUSES:
+            return None
+        safe = idempotent or (status in NOT_PROCESSED_STATUSES) or (status is None and not connection_made)
+        if not safe or not self.budget(endpoint).try_spend():
+            return None
+        requested = parse_retry_after(retry_after)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _attempt_delay(
+        self,
+        endpoint: str,
+        attempt: int,
+        idempotent: bool,
+        response: Any = None,
+        error: BaseException | None = None,
+        connect_errors: tuple[type[BaseException], ...] = CONNECT_ERRORS,
+    ) -> float | None:
+        """retry_delay for the outcome of an attempt: a response, or a transport `error` when there was none."""
+        if error is not None:
+            connection_made = not isinstance(error, connect_errors)
+            return self.retry_delay(endpoint, attempt, idempotent, connection_made=connection_made)
+        return self.retry_delay(
+            endpoint, attempt, idempotent, response.status_code, response.headers.get("Retry-After")
+        )
+
+    def call(
+        self,
+        endpoint: str,
+        send: Callable[[], requests.Response],
+        idempotent: bool,
+        transport_errors: tuple[type[BaseException], ...] = TRANSPORT_ERRORS,
+        connect_errors: tuple[type[BaseException], ...] = CONNECT_ERRORS,
+    ) -> requests.Response:
+        """Calls `send` until it returns a non-retryable response or retries run out, and returns the last
+        response. `send` is called again for every attempt, so it must rebuild streamed bodies itself.
+        """
+        budget = self.budget(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            budget.on_request()
+            try:
+                response = send()
+            except transport_errors as e:
+                delay = self._attempt_delay(endpoint, attempt, idempotent, error=e, connect_errors=connect_errors)
+                if delay is None:
+                    raise
+            else:
+                delay = self._attempt_delay(endpoint, attempt, idempotent, response)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+
+    async def acall(
+        self,
+        endpoint: str,
+        send: Callable[[], Awaitable[Any]],
+        idempotent: bool,
+        transport_errors: tuple[type[BaseException], ...],
+        connect_errors: tuple[type[BaseException], ...] = (),
+    ) -> Any:
+        """Async counterpart of `call` for clients other than `requests` (e.g. httpx), whose exceptions are
+        passed in. The returned response needs `status_code`, `headers` and `aclose()`.
+        """
+        budget = self.budget(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            budget.on_request()
+            try:
+                response = await send()
+            except transport_errors as e:
+                delay = self._attempt_delay(endpoint, attempt, idempotent, error=e, connect_errors=connect_errors)
+                if delay is None:
+                    raise
+            else:
+                delay = self._attempt_delay(endpoint, attempt, idempotent, response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+
+
+_policy = RetryPolicy()
+
+
+def get_policy() -> RetryPolicy:
+    return _policy
+
+
+def set_policy(policy: RetryPolicy) -> None:
+    global _policy
+    _policy = policy
@@ -0,0 +1,68 @@
+"""Single-flight call coalescing: concurrent calls with the same key share one execution.
+
+The first caller of `do(key, fn)` runs `fn`; callers arriving while it runs wait for it and get the same
+result (or exception) instead of repeating the work. Used by process_cad_file so that two users opening the
+same file at once share one upload and one translation.
+"""
+import threading
+
+from typing import Any, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+Listener = Callable[..., None]
+
+
+class _Call(Generic[T]):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+        self.listeners: list[Listener] = []
+        self.last_notification: tuple[Any, ...] | None = None
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self):
+        self._calls: dict[Hashable, _Call[T]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[Listener], T], listener: Listener | None = None) -> tuple[T, bool]:
+        """Runs `fn`, or waits for the call with the same key that is already running.
+        Returns (result, shared), where `shared` tells whether the result came from another caller's call.
+        `fn` gets a `notify(*args)` function that forwards progress to the `listener` of every caller;
+        callers joining late first get the last notification again.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            if listener is not None:
+                call.listeners.append(listener)
+            last_notification = call.last_notification
+
+        if not leader:
+            if listener is not None and last_notification is not None:
+                listener(*last_notification)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        def notify(*args) -> None:
+            with self._lock:
+                call.last_notification = args
+                listeners = list(call.listeners)
+            for each in listeners:
+                each(*args)
+
+        try:
+            call.result = fn(notify)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,230 @@
+"""Timing spans for the stages of process_cad_file.
+
+Stages are wrapped in `span("stage")`. Finished spans go to the configured sinks, and with no sinks configured
+a span costs next to nothing. Sinks can be added in code with `add_sink`, or through APS_TELEMETRY as a
+comma-separated list:
+
+    APS_TELEMETRY="memory,jsonl:/var/log/aps/spans.jsonl,prometheus:/var/lib/node_exporter/aps.prom,otlp:/tmp/otlp.jsonl"
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Iterator, Protocol
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float  # unix time
+    duration: float = 0.0  # seconds
+    status: str = "ok"
+    attributes: dict = field(default_factory=dict)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+
+class Sink(Protocol):
+    def emit(self, span: Span) -> None: ...
+
+
+_sinks: list[Sink] = []
+_sinks_lock = threading.Lock()
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("aps_current_span", default=None)
+
+
+def add_sink(sink: Sink) -> Sink:
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink: Sink) -> None:
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """Times the block as a span nested under the current one. Attributes can be added on the yielded span.
+    A `bytes` attribute gets a matching `throughput_bytes_per_s` when the span ends.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent else None,
+        start_time=time.time(),
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.attributes.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        if current.attributes.get("bytes") and current.duration > 0:
+            current.attributes["throughput_bytes_per_s"] = round(current.attributes["bytes"] / current.duration)
+        for sink in list(_sinks):
+            try:
+                sink.emit(current)
+            except Exception:
+                pass  # Telemetry must never break a job
+
+
+class InMemorySink:
+    """Keeps finished spans in memory, e.g. for benchmarks."""
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def durations(self, name: str) -> list[float]:
+        with self._lock:
+            return [span.duration for span in self.spans if span.name == name]
+
+
+class JsonLinesSink:
+    """Appends every span as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        line = json.dumps(asdict(span), default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class PrometheusSink:
+    """Aggregates spans into Prometheus histograms (per stage) plus an uploaded-bytes counter.
+    `render()` returns the text exposition format; with a `path` it is also written there after every span,
+    for node_exporter's textfile collector.
+    """
+
+    BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._counts: dict[tuple[str, str], list[int]] = {}
+        self._sums: dict[tuple[str, str], float] = {}
+        self._uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        key = (span.name, span.status)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.BUCKETS) + 1))
+            for i, bound in enumerate(self.BUCKETS):
+                if span.duration <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + span.duration
+            if span.name == "s3_put":
+                self._uploaded_bytes += span.attributes.get("bytes", 0)
+            text = self._render() if self.path else None
+        if text is not None:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def render(self) -> str:
+        with self._lock:
+            return self._render()
+
+    def _render(self) -> str:
+        lines = [
+            "# HELP aps_stage_duration_seconds Duration of process_cad_file stages.",
+            "# TYPE aps_stage_duration_seconds histogram",
+        ]
+        for (name, status), counts in sorted(self._counts.items()):
+            labels = f'stage="{name}",status="{status}"'
+            for bound, count in zip(self.BUCKETS, counts):
+                lines.append(f'aps_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'aps_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+            lines.append(f"aps_stage_duration_seconds_sum{{{labels}}} {self._sums[(name, status)]:.6f}")
+            lines.append(f"aps_stage_duration_seconds_count{{{labels}}} {counts[-1]}")
+        lines += [
+            "# HELP aps_uploaded_bytes_total Bytes uploaded to S3.",
+            "# TYPE aps_uploaded_bytes_total counter",
+            f"aps_uploaded_bytes_total {self._uploaded_bytes}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def to_otlp(span: Span) -> dict:
+    """Converts a span to the OTLP/JSON span shape used by OpenTelemetry collectors."""
+    start_ns = int(span.start_time * 1e9)
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(span.duration * 1e9)),
+        "status": {"code": 2 if span.status == "error" else 1},
+        "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span.attributes.items()],
+    }
+
+
+class OTLPJsonLinesSink(JsonLinesSink):
+    """Like JsonLinesSink, but writes OTLP-shaped spans (one resourceSpans export per line)."""
+
+    def emit(self, span: Span) -> None:
+        export = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "aps-demos"}}]},
+                    "scopeSpans": [{"scope": {"name": "aps-demos.tools"}, "spans": [to_otlp(span)]}],
+                }
+            ]
+        }
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(export) + "\n")
+
+
+def configure_from_env(value: str | None = None) -> list[Sink]:
+    """Adds the sinks listed in APS_TELEMETRY (see module docstring) and returns them."""
+    value = os.environ.get("APS_TELEMETRY", "") if value is None else value
+    sinks: list[Sink] = []
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        kind, _, path = entry.partition(":")
+        if kind == "memory":
+            sinks.append(InMemorySink())
+        elif kind == "jsonl" and path:
+            sinks.append(JsonLinesSink(path))
+        elif kind == "prometheus":
+            sinks.append(PrometheusSink(path or None))
+        elif kind == "otlp" and path:
+            sinks.append(OTLPJsonLinesSink(path))
+    for sink in sinks:
+        add_sink(sink)
+    return sinks
+
+
+configure_from_env()
@@ -1,12 +1,30 @@
 import os
+import json
 import time
 import base64
+import re
+import math
+import random
+import tempfile
+import threading
+import contextvars
 import requests #type: ignore
+import webhooks
+import telemetry
+import result_cache
+import manifest as md_manifest
+import retry
+import ratelimit
+import singleflight
 import viktor as vkt #type: ignore
 
-from functools import lru_cache
+from requests.adapters import HTTPAdapter #type: ignore
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from typing import Annotated
+from pathlib import Path
+from typing import Annotated, Callable
+from upload_source import FileContent, UploadSource, as_upload_source
 
 load_dotenv()
 
@@ -14,39 +32,225 @@ CLIENT_ID = os.environ.get("CLIENT_ID")
 CLIENT_SECRET = os.environ.get("CLIENT_SECRET")
 
 
-APS_BASE_URL = "https://developer.api.autodesk.com"
+# APS_BASE_URL can point the app at another host, e.g. the local stand-in server in fake_aps.py.
+APS_BASE_URL = os.environ.get("APS_BASE_URL", "https://developer.api.autodesk.com").rstrip("/")
 OSS_BASE_URL = f"{APS_BASE_URL}/oss/v2"
 MD_BASE_URL = f"{APS_BASE_URL}/modelderivative/v2"
 DA_BASE_URL = f"{APS_BASE_URL}/da/us-east/v3"
 AUTH_URL = f"{APS_BASE_URL}/authentication/v2/token"
+WEBHOOKS_BASE_URL = f"{APS_BASE_URL}/webhooks/v1"
+
 SCOPES = "data:read data:write data:create bucket:create bucket:read code:all"
 
-@lru_cache(maxsize=1)
-def get_token(client_id: str, client_secret: str) -> str:
-    vkt.UserMessage.info("Requesting new 2-legged token...")
-
-    response = requests.post(
-        AUTH_URL,
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "client_credentials",
-            "scope": SCOPES,
-        },
-        timeout=15,
-    )
-    response.raise_for_status()
-    token = response.json()["access_token"]
-    vkt.UserMessage.info("Token obtained successfully.")
+# Max keep-alive connections kept open per host (APS and the S3 upload host).
+HTTP_POOL_SIZE = int(os.environ.get("APS_HTTP_POOL_SIZE", "10"))
+
+# Files larger than one part are uploaded in parts of this size (S3 requires at least 5 MB per part).
+UPLOAD_PART_SIZE = int(os.environ.get("APS_UPLOAD_PART_SIZE", str(16 * 1024 * 1024)))
+# Number of parts uploaded in parallel.
+UPLOAD_CONCURRENCY = int(os.environ.get("APS_UPLOAD_CONCURRENCY", "4"))
+# signeds3upload hands out at most 25 presigned URLs per request.
+MAX_PARTS_PER_REQUEST = 25
+# Lifetime of presigned upload URLs (APS allows 1-60, default 2). Batches are also only requested when needed.
+UPLOAD_URL_EXPIRATION = int(os.environ.get("APS_UPLOAD_URL_EXPIRATION", "60"))
+
+# Translation polling: start fast, back off exponentially (with jitter) up to the cap, give up after the deadline.
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = float(os.environ.get("APS_POLL_MAX_DELAY", "15"))
+TRANSLATION_TIMEOUT = float(os.environ.get("APS_TRANSLATION_TIMEOUT", "1800"))
+# With webhooks the manifest is only polled as a safety net in case a callback never arrives.
+WEBHOOK_POLL_MAX_DELAY = float(os.environ.get("APS_WEBHOOK_POLL_MAX_DELAY", "60"))
+
+# Called with (stage, detail) as process_cad_file advances, e.g. ("translating", "45% complete").
+# Right after the translation job is submitted it is called once with ("submitted", urn).
+ProgressCallback = Callable[[str, str], None]
+# A token, or a callable returning the current one (see TokenProvider), which is then asked again for every request.
+# Long jobs pass a callable, so they never send a token that expired while they were running.
+Token = str | Callable[[], str]
+
+# Optional JSON file remembering which buckets exist, so new processes skip the create call as well.
+BUCKET_CACHE_PATH = os.environ.get("APS_BUCKET_CACHE_PATH")
+
+
+def configure_base_url(base_url: str) -> None:
+    """Points every APS call at `base_url` at runtime (used by the benchmarks to target fake_aps)."""
+    global APS_BASE_URL, OSS_BASE_URL, MD_BASE_URL, DA_BASE_URL, AUTH_URL, WEBHOOKS_BASE_URL
+    APS_BASE_URL = base_url.rstrip("/")
+    OSS_BASE_URL = f"{APS_BASE_URL}/oss/v2"
+    MD_BASE_URL = f"{APS_BASE_URL}/modelderivative/v2"
+    DA_BASE_URL = f"{APS_BASE_URL}/da/us-east/v3"
+    AUTH_URL = f"{APS_BASE_URL}/authentication/v2/token"
+    WEBHOOKS_BASE_URL = f"{APS_BASE_URL}/webhooks/v1"
+    # Tokens are only valid at the host that issued them
+    _token_cache.clear()
+
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide pooled session used for every APS and S3 call, so connections are reused."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+# Rate limit family (see ratelimit.py) of each endpoint passed to aps_request.
+ENDPOINT_FAMILIES = {
+    "token": "auth",
+    "create_bucket": "oss",
+    "object_details": "oss",
+    "presign": "oss",
+    "finalize": "oss",
+    "job_submit": "md",
+    "manifest": "md",
+    "metadata": "md",
+    "object_tree": "md",
+    "properties": "md",
+    "webhooks": "webhooks",
+}
+
+
+def aps_request(
+    method: str, url: str, endpoint: str, idempotent: bool | None = None, token: Token | None = None, **kwargs
+) -> requests.Response:
+    """Sends a request on the pooled session under the shared retry policy (see retry.py) and rate limits.
+    `endpoint` names the retry budget; `idempotent` defaults to True for GET, HEAD and PUT.
+    `token` is sent as the bearer token, resolved per attempt. When APS answers 401 and the token came from a
+    TokenProvider, the provider drops it and the request is sent once more with a new one.
+    """
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD", "PUT")
+    family = ENDPOINT_FAMILIES.get(endpoint, endpoint)
+    sent_token = None
+
+    def send() -> requests.Response:
+        nonlocal sent_token
+        # Every attempt, retries included, counts against the quota
+        ratelimit.get_rate_limiter().acquire(family)
+        if token is not None:
+            sent_token = resolve_token(token)
+            kwargs["headers"] = {**kwargs.get("headers", {}), "Authorization": f"Bearer {sent_token}"}
+        return get_session().request(method, url, **kwargs)
+
+    response = retry.get_policy().call(endpoint, send, idempotent)
+    if response.status_code == 401 and isinstance(token, TokenProvider):
+        response.close()
+        token.invalidate(sent_token)
+        response = retry.get_policy().call(endpoint, send, idempotent)
+    return response
+
+
+# Refresh tokens this many seconds before APS says they expire, so a request never goes out with a stale token.
+TOKEN_REFRESH_MARGIN = 300
+# Scope of the token embedded in the viewer page: it can read derivatives but not upload, delete or create buckets.
+VIEWER_SCOPES = "viewables:read"
+# The browser keeps its token for the whole viewing session, so it only gets tokens with this much lifetime left.
+VIEWER_TOKEN_MIN_LIFETIME = 30 * 60
+
+# (client_id, scope) -> (access_token, monotonic expiry time)
+_token_cache: dict[tuple[str, str], tuple[str, float]] = {}
+_token_locks: dict[tuple[str, str], threading.Lock] = {}
+_token_locks_guard = threading.Lock()
+
+
+def _token_lock(key: tuple[str, str]) -> threading.Lock:
+    with _token_locks_guard:
+        return _token_locks.setdefault(key, threading.Lock())
+
+
+def cached_token(client_id: str, scope: str, refresh_margin: float = TOKEN_REFRESH_MARGIN) -> str | None:
+    """Returns the cached token for (client_id, scope) if it is valid for at least `refresh_margin` seconds more."""
+    cached = _token_cache.get((client_id, scope))
+    if cached and time.monotonic() < cached[1] - refresh_margin:
+        return cached[0]
+    return None
+
+
+def store_token(client_id: str, scope: str, token_data: dict) -> str:
+    """Caches a token response from the auth endpoint and returns its access token."""
+    token = token_data["access_token"]
+    _token_cache[(client_id, scope)] = (token, time.monotonic() + token_data.get("expires_in", 3599))
     return token
 
 
-def create_bucket_if_not_exists(token: str, bucket_key: str) -> None:
+def token_request_data(client_id: str, client_secret: str, scope: str) -> dict:
+    return {
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "client_credentials",
+        "scope": scope,
+    }
+
+
+def get_token(
+    client_id: str, client_secret: str, scope: str = SCOPES, refresh_margin: float = TOKEN_REFRESH_MARGIN
+) -> str:
+    """Returns a cached 2-legged token for (client_id, scope), requesting a new one when it is about to expire."""
+    with _token_lock((client_id, scope)):
+        token = cached_token(client_id, scope, refresh_margin)
+        if token:
+            return token
+
+        vkt.UserMessage.info("Requesting new 2-legged token...")
+        with telemetry.span("token", scope=scope):
+            response = aps_request(
+                "POST", AUTH_URL, "token", idempotent=True,
+                data=token_request_data(client_id, client_secret, scope), timeout=15,
+            )
+            response.raise_for_status()
+        token = store_token(client_id, scope, response.json())
+        vkt.UserMessage.info("Token obtained successfully.")
+        return token
+
+
+def get_viewer_token(client_id: str, client_secret: str) -> str:
+    """Token handed to the browser viewer: `viewables:read` only, cached (and locked) apart from the upload token."""
+    return get_token(client_id, client_secret, VIEWER_SCOPES, refresh_margin=VIEWER_TOKEN_MIN_LIFETIME)
+
+
+def resolve_token(token: Token) -> str:
+    return token() if callable(token) else token
+
+
+class TokenProvider:
+    """Returns the current cached token for (client_id, scope) whenever it is called, refreshing it as needed.
+    Pass one instead of a token string to anything that runs for a while (uploads, translation polling).
+    """
+
+    def __init__(self, client_id: str, client_secret: str, scope: str = SCOPES):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+
+    def __call__(self) -> str:
+        return get_token(self.client_id, self.client_secret, self.scope)
+
+    def invalidate(self, token: str | None) -> None:
+        """Drops `token` from the cache after APS rejected it, unless another thread already replaced it."""
+        with _token_lock((self.client_id, self.scope)):
+            cached = _token_cache.get((self.client_id, self.scope))
+            if cached is not None and cached[0] == token:
+                del _token_cache[(self.client_id, self.scope)]
+
+
+def create_bucket_if_not_exists(token: Token, bucket_key: str) -> None:
     vkt.UserMessage.info("Checking/Creating bucket")
-    response = requests.post(
+    # Creating a bucket twice just yields a 409, so it is safe to retry
+    response = aps_request(
+        "POST",
         f"{OSS_BASE_URL}/buckets",
+        "create_bucket",
+        idempotent=True,
         json={"bucketKey": bucket_key, "policyKey": "transient"},
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        token=token, headers={"Content-Type": "application/json"},
         timeout=15,
     )
     if response.status_code not in [200, 409]:
@@ -54,92 +258,618 @@ def create_bucket_if_not_exists(token: str, bucket_key: str) -> None:
     vkt.UserMessage.info("Bucket checked/created successfully.")
 
 
-def upload_to_OSS(token: str, object_name: str, file_content: bytes, bucket_key: str) -> Annotated[str, "Object ID"]:
+class BucketNotFoundError(requests.exceptions.HTTPError):
+    """Raised when an OSS call reports that the bucket does not exist (anymore)."""
+
+
+def _raise_for_bucket_not_found(response: requests.Response) -> None:
+    if response.status_code == 404 and re.search(r"bucket\s+(not found|does not exist)", response.text, re.IGNORECASE):
+        raise BucketNotFoundError(f"Bucket not found: {response.url}", response=response)
+
+
+# (client_id, bucket_key) pairs known to exist, loaded from BUCKET_CACHE_PATH on first use
+_known_buckets: set[tuple[str, str]] | None = None
+_known_buckets_lock = threading.Lock()
+
+
+def _load_known_buckets() -> set[tuple[str, str]]:
+    global _known_buckets
+    if _known_buckets is None:
+        _known_buckets = set()
+        if BUCKET_CACHE_PATH and os.path.exists(BUCKET_CACHE_PATH):
+            try:
+                with open(BUCKET_CACHE_PATH) as f:
+                    _known_buckets = {tuple(entry) for entry in json.load(f)}
+            except (OSError, ValueError):
+                pass
+    return _known_buckets
+
+
+def configure_bucket_cache(path: str | None) -> None:
+    """Switches the known-bucket cache to the JSON file `path` (None: in memory only) and forgets what is known,
+    so e.g. the benchmarks neither read nor write the app's own cache.
+    """
+    global BUCKET_CACHE_PATH, _known_buckets
+    with _known_buckets_lock:
+        BUCKET_CACHE_PATH = path
+        _known_buckets = None
+
+
+def _save_known_buckets() -> None:
+    if not BUCKET_CACHE_PATH:
+        return
+    # A temporary file of our own, as other worker processes may be saving the same cache at the same time
+    directory, name = os.path.split(os.path.abspath(BUCKET_CACHE_PATH))
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile("w", dir=directory, prefix=f"{name}.", suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            json.dump(sorted(_known_buckets), f)
+        os.replace(tmp_path, BUCKET_CACHE_PATH)
+    except OSError:
+        # The cache only saves bucket checks; failing to write it must not fail the job
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ensure_bucket(token: Token, bucket_key: str, client_id: str) -> None:
+    """Creates the bucket unless it is already known to exist for this client_id."""
+    with telemetry.span("bucket_check") as bucket_span:
+        with _known_buckets_lock:
+            known = (client_id, bucket_key) in _load_known_buckets()
+        bucket_span.set(cached=known)
+        if known:
+            return
+        create_bucket_if_not_exists(token=token, bucket_key=bucket_key)
+        with _known_buckets_lock:
+            _load_known_buckets().add((client_id, bucket_key))
+            _save_known_buckets()
+
+
+def forget_bucket(client_id: str, bucket_key: str) -> None:
+    """Drops a bucket from the known set, e.g. after an OSS call returned bucket-not-found."""
+    with _known_buckets_lock:
+        _load_known_buckets().discard((client_id, bucket_key))
+        _save_known_buckets()
+
+
+def get_signed_upload_urls(
+    token: Token,
+    s3_upload_endpoint: str,
+    parts: int = 1,
+    first_part: int = 1,
+    upload_key: str | None = None,
+    minutes_expiration: int = UPLOAD_URL_EXPIRATION,
+) -> dict:
+    """Requests a batch of presigned S3 URLs. Passing the uploadKey of an earlier batch continues the same upload."""
+    params = {"parts": parts, "firstPart": first_part, "minutesExpiration": minutes_expiration}
+    if upload_key:
+        params["uploadKey"] = upload_key
+    with telemetry.span("presign", parts=parts):
+        response = aps_request(
+            "GET", s3_upload_endpoint, "presign", params=params, token=token, timeout=15
+        )
+    _raise_for_bucket_not_found(response)
+    response.raise_for_status()
+    return response.json()
+
+
+def _put_part(
+    url: str, source: UploadSource, offset: int, length: int, presign_again: Callable[[], str] | None = None
+) -> None:
+    """PUTs one part. If S3 refuses the URL (403, e.g. it expired), it is presigned again with `presign_again`
+    and the part is sent once more.
+    """
+    def send() -> requests.Response:
+        # A fresh reader per attempt, so a retried part is sent from its start
+        with source.open_part(offset, length) as part:
+            return get_session().put(url, data=part, timeout=120)
+
+    with telemetry.span("s3_put", offset=offset, bytes=min(length, source.size - offset)) as put_span:
+        s3_response = retry.get_policy().call("s3_put", send, idempotent=True)
+        if s3_response.status_code == 403 and presign_again is not None:
+            put_span.set(presigned_again=True)
+            url = presign_again()
+            s3_response = retry.get_policy().call("s3_put", send, idempotent=True)
+        s3_response.raise_for_status()
+
+
+def upload_to_OSS(
+    token: Token,
+    object_name: str,
+    file_content: FileContent | UploadSource,
+    bucket_key: str,
+    part_size: int = UPLOAD_PART_SIZE,
+    concurrency: int = UPLOAD_CONCURRENCY,
+) -> Annotated[str, "Object ID"]:
     """Presign object for upload using binary content. Allows file upload without needing full APS credentials.
-    Upload file. Uses the presigned URL to perform the upload.
+    Upload file. Uses the presigned URL(s) to perform the upload.
+    Files larger than `part_size` are split into parts that are uploaded in parallel on `concurrency` workers.
+    `file_content` can be bytes, a path or a file object; parts are streamed from it so memory use stays flat.
     """
     vkt.UserMessage.info(f"Uploading binary data as '{object_name}' to OSS bucket...")
-    
-    # Presign URL.
     s3_upload_endpoint = f"{OSS_BASE_URL}/buckets/{bucket_key}/objects/{object_name}/signeds3upload"
-    response = requests.get(s3_upload_endpoint, headers={"Authorization": f"Bearer {token}"}, timeout=15)
-    response.raise_for_status()
-    signed_url_data = response.json()
-    
-    # Upload file to signed url
-    s3_response = requests.put(signed_url_data["urls"][0], data=file_content, timeout=120)
-    s3_response.raise_for_status()
-    finalize_response = requests.post(
-        s3_upload_endpoint,
-        json={"uploadKey": signed_url_data["uploadKey"], "size": len(file_content)},
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        timeout=30,
-    )
-    finalize_response.raise_for_status()
+    with as_upload_source(file_content) as source, telemetry.span("upload", bytes=source.size) as upload_span:
+        size = source.size
+        total_parts = max(1, math.ceil(size / part_size))
+
+        upload_key = None
+
+        def presign_again(part_number: int) -> Callable[[], str]:
+            return lambda: get_signed_upload_urls(token, s3_upload_endpoint, 1, part_number, upload_key)["urls"][0]
+
+        if total_parts == 1:
+            # Single-shot upload
+            signed_url_data = get_signed_upload_urls(token, s3_upload_endpoint)
+            upload_key = signed_url_data["uploadKey"]
+            _put_part(signed_url_data["urls"][0], source, 0, size, presign_again(1))
+        else:
+            vkt.UserMessage.info(f"Uploading {total_parts} parts of {part_size // (1024 * 1024)} MB...")
+            urls: dict[int, str] = {}
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                running = set()
+                for part_number in range(1, total_parts + 1):
+                    # Wait for a free worker first, so each batch of URLs is only requested once the parts
+                    # before it are nearly done, instead of all batches at the start of a long upload
+                    if len(running) >= concurrency:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    if part_number not in urls:
+                        parts = min(MAX_PARTS_PER_REQUEST, total_parts - part_number + 1)
+                        signed_url_data = get_signed_upload_urls(token, s3_upload_endpoint, parts, part_number, upload_key)
+                        upload_key = signed_url_data["uploadKey"]
+                        urls.update(enumerate(signed_url_data["urls"], start=part_number))
+                    offset = (part_number - 1) * part_size
+                    # Run each part in a copy of this context, so its span is nested under the upload span
+                    context = contextvars.copy_context()
+                    running.add(
+                        executor.submit(
+                            context.run, _put_part, urls.pop(part_number), source, offset, part_size,
+                            presign_again(part_number),
+                        )
+                    )
+                for future in running:
+                    future.result()
+        upload_span.set(parts=total_parts)
+        with telemetry.span("finalize"):
+            finalize_response = aps_request(
+                "POST",
+                s3_upload_endpoint,
+                "finalize",
+                json={"uploadKey": upload_key, "size": size},
+                token=token, headers={"Content-Type": "application/json"},
+                timeout=30,
+            )
+            finalize_response.raise_for_status()
     vkt.UserMessage.info(f"Binary data '{object_name}' uploaded successfully.")
     return finalize_response.json()["objectId"]
 
 
+def get_object_details(token: Token, bucket_key: str, object_key: str) -> dict | None:
+    """Returns the OSS object details, or None if the object does not exist."""
+    response = aps_request(
+        "GET",
+        f"{OSS_BASE_URL}/buckets/{bucket_key}/objects/{object_key}/details",
+        "object_details",
+        token=token,
+        timeout=15,
+    )
+    _raise_for_bucket_not_found(response)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def content_object_key(content_hash: str, object_name: str) -> str:
+    """OSS object key derived from the file content. The original extension is kept, MD uses it to pick a translator."""
+    return f"{content_hash}{Path(object_name).suffix}"
+
+
 def safe_base64_encode(text: str) -> str:
     return base64.urlsafe_b64encode(text.encode()).decode().strip("=")
 
 
-def start_svf_translation_job(token: str, object_urn: str):
+_registered_hooks: set[tuple[str, str]] = set()
+_registered_hooks_lock = threading.Lock()
+
+
+def register_extraction_hook(token: Token, callback_url: str, workflow: str) -> None:
+    """Registers (once per process) an `extraction.finished` webhook for jobs submitted with this workflow id."""
+    with _registered_hooks_lock:
+        if (callback_url, workflow) in _registered_hooks:
+            return
+        response = aps_request(
+            "POST",
+            f"{WEBHOOKS_BASE_URL}/systems/derivative/events/{webhooks.EXTRACTION_FINISHED}/hooks",
+            "webhooks",
+            idempotent=True,
+            json={"callbackUrl": callback_url, "scope": {"workflow": workflow}},
+            token=token, headers={"Content-Type": "application/json"},
+            timeout=15,
+        )
+        # 409: a hook with this callback and scope already exists
+        if response.status_code not in [200, 201, 409]:
+            response.raise_for_status()
+        _registered_hooks.add((callback_url, workflow))
+
+
+VIEWER_OUTPUT_TYPES = ["svf", "svf2"]
+# SVF2 streams far less data into the viewer than legacy SVF, especially for large 3D models.
+OUTPUT_FORMAT = os.environ.get("APS_OUTPUT_FORMAT", "svf2").strip().lower()
+if OUTPUT_FORMAT not in VIEWER_OUTPUT_TYPES:
+    raise ValueError(f"APS_OUTPUT_FORMAT must be one of {', '.join(VIEWER_OUTPUT_TYPES)}, not '{OUTPUT_FORMAT}'")
+OUTPUT_VIEWS = ["2d", "3d"]
+# Viewer `env` and `api` initializer options matching each output format.
+VIEWER_ENVIRONMENTS = {
+    "svf": {"env": "AutodeskProduction", "api": "derivativeV2"},
+    "svf2": {"env": "AutodeskProduction2", "api": "streamingV2"},
+}
+
+
+def has_viewable_derivative(manifest: dict | None, output_types: list[str] = VIEWER_OUTPUT_TYPES) -> bool:
+    """True if the manifest holds a successfully translated derivative of one of the given output types."""
+    if not manifest:
+        return False
+    return any(
+        derivative.get("outputType") in output_types and derivative.get("status") == "success"
+        for derivative in manifest.get("derivatives", [])
+    )
+
+
+def translation_job_request(
+    token: str, object_urn: str, workflow: str | None, force: bool, output_format: str, views: list[str]
+) -> tuple[dict, dict]:
+    """Headers and payload of a Model Derivative job submission."""
+    job_payload = {"input": {"urn": object_urn}, "output": {"formats": [{"type": output_format, "views": list(views)}]}}
+    if workflow:
+        job_payload["misc"] = {"workflow": workflow}
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    if force:
+        headers["x-ads-force"] = "true"
+    return headers, job_payload
+
+
+def start_svf_translation_job(
+    token: Token,
+    object_urn: str,
+    workflow: str | None = None,
+    force: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+    views: list[str] = OUTPUT_VIEWS,
+    check_existing: bool = True,
+) -> Annotated[bool, "Job submitted"]:
     """This translates the object into something readable, e.g., DWG to JSON.
     Using the file URN (Uniform Resource Name), the file is identified
     and the Model Derivative (MD) API translates it.
+    Jobs submitted with a `workflow` id trigger the webhooks registered for that workflow.
+    Unless `force` is set, nothing is submitted when the URN already has a viewable derivative, and
+    the existing derivatives are kept instead of being thrown away with `x-ads-force`.
+    Callers that just looked at the manifest themselves pass `check_existing=False` to skip fetching it again.
+    `output_format` is "svf" or "svf2"; `views` any of "2d" and "3d".
     """
+    if not force and check_existing and has_viewable_derivative(get_manifest(token, object_urn), [output_format]):
+        vkt.UserMessage.info("MD: Derivative already exists, skipping translation.")
+        return False
+
     vkt.UserMessage.info("MD: Starting derivative translation job")
-    job_payload = {"input": {"urn": object_urn}, "output": {"formats": [{"type": "svf", "views": ["2d"]}]}}
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "x-ads-force": "true"}
-    response = requests.post(f"{MD_BASE_URL}/designdata/job", headers=headers, json=job_payload, timeout=30)
-    response.raise_for_status()
+    headers, job_payload = translation_job_request(resolve_token(token), object_urn, workflow, force, output_format, views)
+    # A (forced) new job replaces the derivatives of a cached finished manifest
+    md_manifest.get_manifest_cache().delete(object_urn)
+    with telemetry.span("job_submit", output_format=output_format, force=force):
+        # Without x-ads-force a duplicate submission reuses the running job; with it, it would restart the job
+        response = aps_request(
+            "POST", f"{MD_BASE_URL}/designdata/job", "job_submit", idempotent=not force,
+            token=token, headers=headers, json=job_payload, timeout=30,
+        )
+        response.raise_for_status()
     vkt.UserMessage.info("MD: Translation job submitted.")
+    return True
 
 
-def get_svf_translation_status(token: str, object_urn: str) -> tuple[Annotated[str,"Translation Status"], Annotated[str, "Transalation Progress"]]:
+def get_manifest(token: Token, object_urn: str) -> dict | None:
+    """Returns the Model Derivative manifest, or None if there is none (yet) for this URN."""
+    response = aps_request(
+        "GET", f"{MD_BASE_URL}/designdata/{object_urn}/manifest", "manifest", token=token, timeout=30
+    )
+    if response.status_code in [202, 404]:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def get_svf_translation_status(token: Token, object_urn: str) -> tuple[Annotated[str,"Translation Status"], Annotated[str, "Transalation Progress"]]:
     """Checks the Model Derivative job status ONCE and returns it.
     SVF -> Simple Viewer Format (translated)
     """
-    response = requests.get(
-        f"{MD_BASE_URL}/designdata/{object_urn}/manifest", headers={"Authorization": f"Bearer {token}"}, timeout=30
-    )
-    if response.status_code == 202:
+    with telemetry.span("poll") as poll_span:
+        manifest = get_manifest(token, object_urn)
+        md_status, md_progress = translation_status(manifest)
+        poll_span.set(md_status=md_status, md_progress=md_progress)
+    if md_status in ["success", "failed", "timeout"]:
+        # The final poll returns the full manifest; keep it so the viewer does not have to fetch it again
+        md_manifest.get_manifest_cache().put(object_urn, md_manifest.Manifest.parse(manifest))
+    return md_status, md_progress
+
+
+def get_manifest_index(token: Token, object_urn: str) -> md_manifest.Manifest | None:
+    """The parsed manifest (derivatives, viewables, resources) of a URN, cached once its translation finished."""
+    cache = md_manifest.get_manifest_cache()
+    cached = cache.get(object_urn)
+    if cached is not None:
+        return cached
+    manifest = get_manifest(token, object_urn)
+    if manifest is None:
+        return None
+    parsed = md_manifest.Manifest.parse(manifest)
+    cache.put(object_urn, parsed)
+    return parsed
+
+
+def translation_status(manifest: dict | None) -> tuple[str, str]:
+    if manifest is None:
         return "inprogress", "Manifest not ready"
-    response.raise_for_status()
-    manifest = response.json()
     return manifest.get("status"), manifest.get("progress", "N/A")
 
 
-def process_cad_file(object_name: str, file_content: bytes, token: str, client_id: str) -> Annotated[str, "Uniform Resource Name"]:
-    """Process the CAD file to suit the requirements of the APS viewer.
-    1. Create or check if a bucket exists. A unique bucket is created or checked if it exists.
-    2. Upload the file to an OSS bucket (A bucket is created using the client ID).
-    3. Translate the file into SVF.
-    4. Return the URN once the model is translated.
+def _parse_progress(progress: str) -> float | None:
+    """Turns a manifest progress string such as '45% complete' into 45.0."""
+    if progress == "complete":
+        return 100.0
+    match = re.search(r"(\d+(?:\.\d+)?)%", progress or "")
+    return float(match.group(1)) if match else None
+
+
+class PollSchedule:
+    """Decides how long to wait before the next manifest poll.
+    Delays grow exponentially from `initial_delay` up to `max_delay`. Once the reported progress moves, the next
+    poll is instead aimed at half the predicted remaining time. Every delay gets +/-20% jitter.
     """
-    # Check or create a bucket for VIKTOR
-    BUCKET_KEY = f"viktor-bucket-{client_id.lower()}"
-    create_bucket_if_not_exists(token=token, bucket_key=BUCKET_KEY)
-    # Upload file to the bucket
-    oss_object_id = upload_to_OSS(token=token, object_name=object_name, file_content=file_content, bucket_key=BUCKET_KEY)
-    urn = safe_base64_encode(oss_object_id)
-    # Translate file to be able to be used by the APS viewer
-    start_svf_translation_job(token, urn)
 
-    md_finished = False
+    def __init__(
+        self,
+        initial_delay: float = POLL_INITIAL_DELAY,
+        max_delay: float = POLL_MAX_DELAY,
+        timeout: float = TRANSLATION_TIMEOUT,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self._delay = initial_delay
+        self._first_progress: tuple[float, float] | None = None
 
-    while not md_finished:
+    def observe(self, md_progress: str | None) -> None:
+        """Records one poll; pass None when the poll itself failed."""
+        self._delay = min(self.max_delay, self._delay * 2)
+        percent = _parse_progress(md_progress) if md_progress is not None else None
+        now = time.monotonic()
+        if percent is None:
+            return
+        if self._first_progress is None or percent < self._first_progress[1]:
+            self._first_progress = (now, percent)
+        elif percent > self._first_progress[1]:
+            rate = (percent - self._first_progress[1]) / (now - self._first_progress[0])
+            self._delay = min(self.max_delay, max(self.initial_delay, (100 - percent) / rate / 2))
+
+    def next_delay(self) -> float:
+        """Seconds until the next poll. Raises a UserError once the deadline has passed."""
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise vkt.UserError(f"Model Derivative translation did not finish within {self.timeout:.0f} s.")
+        return min(remaining, self._delay * random.uniform(0.8, 1.2))
+
+
+def wait_for_translation(
+    token: Token,
+    object_urn: str,
+    initial_delay: float = POLL_INITIAL_DELAY,
+    max_delay: float = POLL_MAX_DELAY,
+    timeout: float = TRANSLATION_TIMEOUT,
+    wake_event: threading.Event | None = None,
+    on_progress: ProgressCallback | None = None,
+) -> None:
+    """Polls the manifest until the translation finishes, returning as soon as it does.
+    Poll delays follow a PollSchedule. Raises a UserError on failure or after `timeout`.
+    When `wake_event` is given (set by a webhook callback), the manifest is checked as soon as it fires.
+    """
+    schedule = PollSchedule(initial_delay, max_delay, timeout)
+
+    while True:
         try:
-            md_status, md_progress = get_svf_translation_status(token, urn)
+            md_status, md_progress = get_svf_translation_status(token, object_urn)
             vkt.UserMessage.info(f"  > MD Status: {md_status} ({md_progress})")
-
-            if md_status in ["success", "failed"]:
-                md_finished = True
-                if md_status == "failed":
-                    raise vkt.UserError("Model Derivative translation failed!")
+            if on_progress is not None:
+                on_progress("translating", md_progress)
+            if md_status == "success":
+                return
+            if md_status in ["failed", "timeout"]:
+                raise vkt.UserError("Model Derivative translation failed!")
+            schedule.observe(md_progress)
         except requests.exceptions.RequestException as e:
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code == 401:
+                # Still refused with a fresh token (see aps_request): polling on will not help
+                raise
             vkt.UserMessage.info(f"  > Error checking MD status: {e}. Retrying...")
-        
-        time.sleep(10)
-    return urn
\ No newline at end of file
+            schedule.observe(None)
+
+        delay = schedule.next_delay()
+        if wake_event is None:
+            time.sleep(delay)
+        elif wake_event.wait(delay):
+            wake_event.clear()
+
+
+def _find_or_upload_object(
+    token: Token, bucket_key: str, object_key: str, source: UploadSource
+) -> tuple[Annotated[str, "Object ID"], Annotated[bool, "Uploaded"]]:
+    object_details = get_object_details(token, bucket_key, object_key)
+    if object_details is not None:
+        return object_details["objectId"], False
+    # Upload file to the bucket
+    return upload_to_OSS(token=token, object_name=object_key, file_content=source, bucket_key=bucket_key), True
+
+
+def _content_hash(source: UploadSource) -> str:
+    if source.hashed:
+        return source.sha256()
+    with telemetry.span("hash", bytes=source.size):
+        return source.sha256()
+
+
+@dataclass(frozen=True)
+class SubmittedFile:
+    urn: str
+    content_hash: str
+    translated: bool  # True when a usable translation already existed, so there is nothing to wait for
+
+
+def submit_cad_file(
+    object_name: str,
+    file_content: FileContent | UploadSource,
+    token: Token,
+    client_id: str,
+    force: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+    views: list[str] = OUTPUT_VIEWS,
+    workflow: str | None = None,
+    on_progress: ProgressCallback | None = None,
+) -> SubmittedFile:
+    """First half of process_cad_file: hash, upload and submit the translation, without waiting for it.
+    1. Hash the file and return the cached URN if this content was translated recently (see result_cache).
+    2. Create or check if a bucket exists. A unique bucket is created or checked if it exists.
+       Objects are named by their SHA-256, so an already uploaded file is found by name.
+    3. Upload the file to an OSS bucket (A bucket is created using the client ID), unless it is already there.
+    4. Translate the file into SVF or SVF2 (`output_format`), unless a successful translation already exists.
+    Existing translations are only redone (forced) when `force` is set or the object was just (re-)uploaded.
+    """
+    report = on_progress or (lambda stage, detail: None)
+    BUCKET_KEY = f"viktor-bucket-{client_id.lower()}"
+
+    with as_upload_source(file_content) as source:
+        report("hashing", "")
+        content_hash = _content_hash(source)
+        # Translated before (within the bucket's 24 h retention): no APS calls needed at all
+        cached = None if force else result_cache.get_result_cache().get(client_id, content_hash, output_format)
+        if cached is not None:
+            vkt.UserMessage.info(f"'{object_name}' found in the result cache.")
+            return SubmittedFile(cached.urn, content_hash, translated=True)
+
+        # Check or create a bucket for VIKTOR (skipped when the bucket is already known to exist)
+        report("uploading", "")
+        ensure_bucket(token=token, bucket_key=BUCKET_KEY, client_id=client_id)
+        object_key = content_object_key(content_hash, object_name)
+        try:
+            object_id, uploaded = _find_or_upload_object(token, BUCKET_KEY, object_key, source)
+        except BucketNotFoundError:
+            # Our record of the bucket is stale; create it again and retry once
+            forget_bucket(client_id, BUCKET_KEY)
+            ensure_bucket(token=token, bucket_key=BUCKET_KEY, client_id=client_id)
+            object_id, uploaded = _find_or_upload_object(token, BUCKET_KEY, object_key, source)
+    urn = safe_base64_encode(object_id)
+
+    if uploaded:
+        manifest = None
+        # The source changed: drop any manifest left behind by an earlier (expired) copy of this object
+        force = True
+    else:
+        manifest = None if force else get_manifest(token, urn)
+        if has_viewable_derivative(manifest, [output_format]):
+            vkt.UserMessage.info(f"'{object_name}' was already translated, reusing it.")
+            result_cache.get_result_cache().put(client_id, content_hash, output_format, urn)
+            # Keep the finished manifest, so the viewer does not have to fetch it again
+            md_manifest.get_manifest_cache().put(urn, md_manifest.Manifest.parse(manifest))
+            return SubmittedFile(urn, content_hash, translated=True)
+        vkt.UserMessage.info(f"'{object_name}' is already uploaded, skipping upload.")
+        # A failed earlier translation has to be forced, otherwise MD just keeps the failed manifest
+        force = force or (manifest is not None and manifest.get("status") in ["failed", "timeout"])
+
+    # Translate file to be able to be used by the APS viewer, unless a translation is already running.
+    # The manifest was checked above (or the object is new), so the job does not fetch it again.
+    if manifest is None or manifest.get("status") not in ["pending", "inprogress"]:
+        start_svf_translation_job(
+            token, urn, workflow=workflow, force=force, output_format=output_format, views=views,
+            check_existing=False,
+        )
+    report("submitted", urn)
+    report("translating", "")
+    return SubmittedFile(urn, content_hash, translated=False)
+
+
+# Coalesces concurrent process_cad_file calls for the same content, see process_cad_file.
+_in_flight: singleflight.SingleFlight[tuple[str, bool]] = singleflight.SingleFlight()
+
+
+def process_cad_file(
+    object_name: str,
+    file_content: FileContent | UploadSource,
+    token: Token,
+    client_id: str,
+    force: bool = False,
+    output_format: str = OUTPUT_FORMAT,
+    views: list[str] = OUTPUT_VIEWS,
+    on_progress: ProgressCallback | None = None,
+) -> Annotated[str, "Uniform Resource Name"]:
+    """Process the CAD file to suit the requirements of the APS viewer.
+    1. Upload the file and submit its translation, reusing earlier uploads and translations (see submit_cad_file).
+    2. Return the URN once the model is translated.
+    `on_progress` is called with (stage, detail) as the job moves through hashing, uploading and translating.
+    Pass a TokenProvider as `token` for long jobs, so requests late in the job do not use an expired token.
+    Concurrent calls for the same content and client share one upload and translation (single-flight).
+    """
+    with telemetry.span("process_cad_file", object_name=object_name, output_format=output_format) as total_span:
+        with as_upload_source(file_content) as source:
+            if on_progress is not None:
+                on_progress("hashing", "")
+            key = (client_id, _content_hash(source), output_format, tuple(views), force)
+            (urn, reused), shared = _in_flight.do(
+                key,
+                lambda notify: _process_cad_file(
+                    object_name, source, token, client_id, force, output_format, views, notify
+                ),
+                on_progress,
+            )
+        if shared:
+            vkt.UserMessage.info(f"'{object_name}' was being processed already, shared its result.")
+        total_span.set(reused=reused, shared=shared)
+        return urn
+
+
+def _process_cad_file(
+    object_name: str,
+    source: UploadSource,
+    token: Token,
+    client_id: str,
+    force: bool,
+    output_format: str,
+    views: list[str],
+    on_progress: ProgressCallback,
+) -> tuple[Annotated[str, "Uniform Resource Name"], Annotated[bool, "Reused"]]:
+    # Wait for the extraction.finished webhook if enabled, falling back to polling when no callback arrives
+    receiver = webhooks.get_receiver()
+    workflow = None
+    if receiver is not None:
+        try:
+            register_extraction_hook(token, webhooks.CALLBACK_URL, webhooks.WORKFLOW_ID)
+            workflow = webhooks.WORKFLOW_ID
+        except requests.exceptions.RequestException as e:
+            vkt.UserMessage.info(f"Could not register webhook ({e}), polling instead.")
+
+    submitted = submit_cad_file(
+        object_name, source, token, client_id, force, output_format, views, workflow, on_progress
+    )
+    if submitted.translated:
+        return submitted.urn, True
+
+    urn = submitted.urn
+    wake_event = receiver.expect(urn) if workflow else None
+    try:
+        max_delay = WEBHOOK_POLL_MAX_DELAY if wake_event else POLL_MAX_DELAY
+        with telemetry.span("translation_wait", webhook=wake_event is not None):
+            wait_for_translation(token, urn, max_delay=max_delay, wake_event=wake_event, on_progress=on_progress)
+    finally:
+        if wake_event is not None:
+            receiver.forget(urn)
+    result_cache.get_result_cache().put(client_id, submitted.content_hash, output_format, urn)
+    return urn, False
@@ -0,0 +1,165 @@
+import io
+import os
+import hashlib
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+FileContent = bytes | str | os.PathLike | BinaryIO
+
+# Block size used when copying or reading the file in chunks.
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadSource:
+    """Random-access, read-only view of the file being uploaded.
+    Accepts raw bytes, a path on disk or a file object. Non-seekable file objects (e.g. a download stream)
+    are spooled to a temporary file in chunks, so the file never has to be held in memory as a whole.
+    `spool=True` always takes such a private copy, for sources that must outlive the caller's file.
+    """
+
+    def __init__(self, content: FileContent, spool: bool = False):
+        self._path: str | None = None
+        self._file: BinaryIO | None = None
+        self._tmp_path: str | None = None
+        self._sha256: str | None = None
+        self._lock = threading.Lock()
+
+        if spool and isinstance(content, (str, os.PathLike)):
+            with open(content, "rb") as f:
+                self._spool(f)
+        elif spool:
+            self._spool(io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content)
+        elif isinstance(content, (bytes, bytearray)):
+            self._file = io.BytesIO(content)
+        elif isinstance(content, (str, os.PathLike)):
+            self._path = os.fspath(content)
+        elif _is_seekable(content):
+            self._file = content
+        else:
+            self._spool(content)
+
+        if self._path is not None:
+            self.size = os.path.getsize(self._path)
+        else:
+            with self._lock:
+                self._start = self._file.tell()
+                self.size = self._file.seek(0, io.SEEK_END) - self._start
+
+    def _spool(self, content: BinaryIO) -> None:
+        # Hash while spooling, so the content is only read once.
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".upload") as tmp:
+            while chunk := content.read(CHUNK_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+        self._sha256 = digest.hexdigest()
+        self._path = self._tmp_path = tmp.name
+
+    def open_part(self, offset: int = 0, length: int | None = None) -> "PartReader":
+        """Returns a fresh reader over [offset, offset + length). Each call starts from the beginning of the part."""
+        if length is None:
+            length = self.size - offset
+        return PartReader(self, offset, min(length, self.size - offset))
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        with self.open_part() as reader:
+            while chunk := reader.read(chunk_size):
+                yield chunk
+
+    @property
+    def spooled(self) -> bool:
+        """True when the content was copied to a private temporary file, removed again by close()."""
+        return self._tmp_path is not None
+
+    @property
+    def hashed(self) -> bool:
+        """True once the SHA-256 is known, so sha256() returns without reading the content again."""
+        return self._sha256 is not None
+
+    def sha256(self) -> str:
+        """Hex SHA-256 of the content, computed by streaming through it once and then cached."""
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            for chunk in self.iter_chunks():
+                digest.update(chunk)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def _read_at(self, handle: BinaryIO | None, offset: int, size: int) -> bytes:
+        if handle is not None:
+            handle.seek(offset)
+            return handle.read(size)
+        # Shared file object: seek + read must happen atomically when parts are read from several threads.
+        with self._lock:
+            self._file.seek(self._start + offset)
+            return self._file.read(size)
+
+    def close(self) -> None:
+        if self._tmp_path is not None:
+            os.remove(self._tmp_path)
+            self._tmp_path = None
+
+    def __enter__(self) -> "UploadSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PartReader(io.RawIOBase):
+    """File-like reader over one byte range of an UploadSource. It has a length, so requests sends it streamed
+    with a Content-Length header instead of reading it into memory first.
+    """
+
+    def __init__(self, source: UploadSource, offset: int, length: int):
+        self._source = source
+        self._offset = offset
+        self._length = length
+        self._position = 0
+        # Path-based sources get their own handle per part, so parallel parts don't contend on a lock.
+        self._handle = open(source._path, "rb") if source._path is not None else None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        data = self._source._read_at(self._handle, self._offset + self._position, min(size, CHUNK_SIZE))
+        self._position += len(data)
+        return data
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        super().close()
+
+
+@contextmanager
+def as_upload_source(content: "FileContent | UploadSource") -> Iterator[UploadSource]:
+    """Yields `content` as an UploadSource. Sources created here are closed afterwards, passed-in ones are not."""
+    if isinstance(content, UploadSource):
+        yield content
+    else:
+        with UploadSource(content) as source:
+            yield source
+
+
+def _is_seekable(file: BinaryIO) -> bool:
+    try:
+        return file.seekable()
+    except (AttributeError, ValueError):
+        return False
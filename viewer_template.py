@@ -0,0 +1,69 @@
+"""HTML templates for the views, parsed once per process.
+
+A template is split at its `NAME_PLACEHOLDER` tokens when it is loaded, so rendering only joins the literal
+segments with the values, in one pass however many placeholders there are. Values are passed by lower-cased
+name, e.g. `render(aps_token=..., urn=...)` for APS_TOKEN_PLACEHOLDER and URN_PLACEHOLDER.
+With APS_TEMPLATE_RELOAD=true (development), a template is parsed again when its file changes.
+"""
+import os
+import re
+import json
+import threading
+
+from pathlib import Path
+
+TEMPLATE_DIR = Path(__file__).parent
+TEMPLATE_RELOAD = os.environ.get("APS_TEMPLATE_RELOAD", "false").lower() in ["1", "true", "yes"]
+
+PLACEHOLDER_PATTERN = re.compile(r"\b([A-Z][A-Z0-9_]*?)_PLACEHOLDER\b")
+
+
+def to_js(value) -> str:
+    """`value` as a JavaScript literal that is safe to put inside a <script> block."""
+    return json.dumps(value).replace("</", "<\\/")
+
+
+class Template:
+    def __init__(self, path: str | os.PathLike, reload: bool = TEMPLATE_RELOAD):
+        self.path = Path(path)
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        mtime = self.path.stat().st_mtime_ns
+        parts = PLACEHOLDER_PATTERN.split(self.path.read_text())
+        # Literal segments and placeholder names alternate: literal, name, literal, ..., literal
+        self._parsed = (parts[0::2], [name.lower() for name in parts[1::2]])
+        self._mtime = mtime
+
+    @property
+    def names(self) -> set[str]:
+        return set(self._parsed[1])
+
+    def render(self, **values: str) -> str:
+        if self.reload:
+            with self._lock:
+                if self.path.stat().st_mtime_ns != self._mtime:
+                    self._load()
+        segments, names = self._parsed
+        missing = set(names) - values.keys()
+        if missing:
+            raise ValueError(f"{self.path.name} needs values for: {', '.join(sorted(missing))}")
+        out = [segments[0]]
+        for name, segment in zip(names, segments[1:]):
+            out.append(values[name])
+            out.append(segment)
+        return "".join(out)
+
+
+_templates: dict[str, Template] = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(name: str) -> Template:
+    """Returns the template file `name` (relative to the app directory), loading it on first use."""
+    with _templates_lock:
+        if name not in _templates:
+            _templates[name] = Template(TEMPLATE_DIR / name)
+        return _templates[name]
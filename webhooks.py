@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import threading
+import requests #type: ignore
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Public URL APS posts webhook events to (the name matches the key reserved in .env.example).
+CALLBACK_URL = os.environ.get("CALBACK_URL", "").strip()
+# Webhook mode is opt-in: without a publicly reachable CALBACK_URL no events will ever arrive.
+USE_WEBHOOKS = os.environ.get("APS_USE_WEBHOOKS", "").lower() in ["1", "true", "yes"] and bool(CALLBACK_URL)
+# Local port the receiver listens on; defaults to the port of CALBACK_URL (useful behind a tunnel or proxy).
+CALLBACK_PORT = int(os.environ.get("APS_CALLBACK_PORT", "0")) or urlparse(CALLBACK_URL).port or 8080
+# Hooks are scoped to this Model Derivative workflow id, which is sent along with every translation job.
+WORKFLOW_ID = os.environ.get("APS_WEBHOOK_WORKFLOW", "viktor-aps-demos")
+EXTRACTION_FINISHED = "extraction.finished"
+# Events for URNs nobody waits for (yet) are kept this long, and at most this many, in case the waiter shows up late.
+EARLY_EVENT_TTL = 10 * 60
+EARLY_EVENTS_MAX = 1024
+
+
+def normalize_urn(urn: str) -> str:
+    """Webhook payloads may carry padded or standard base64; reduce both to the url-safe form used in tools.py."""
+    urn = urn.removeprefix("urn:")
+    return urn.replace("+", "-").replace("/", "_").rstrip("=")
+
+
+class CallbackReceiver:
+    """Small HTTP server receiving Model Derivative webhook events.
+    Waiters get an event for a URN with `expect`, block on it and `forget` the URN once they are done with it.
+    """
+
+    def __init__(self, port: int = CALLBACK_PORT, host: str = "0.0.0.0"):
+        self._events: dict[str, threading.Event] = {}
+        self._early: OrderedDict[str, float] = OrderedDict()  # URN -> arrival time of an event with no waiter
+        self._lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                # Acknowledge first, APS retries hooks that do not answer quickly.
+                self.send_response(200)
+                self.end_headers()
+                receiver.handle_event(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="aps-webhook-receiver", daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def expect(self, urn: str) -> threading.Event:
+        urn = normalize_urn(urn)
+        with self._lock:
+            event = self._events.setdefault(urn, threading.Event())
+            arrived_at = self._early.pop(urn, None)
+            if arrived_at is not None and time.monotonic() - arrived_at < EARLY_EVENT_TTL:
+                event.set()
+            return event
+
+    def forget(self, urn: str) -> None:
+        with self._lock:
+            self._events.pop(normalize_urn(urn), None)
+
+    def handle_event(self, body: dict) -> None:
+        if body.get("hook", {}).get("event", EXTRACTION_FINISHED) != EXTRACTION_FINISHED:
+            return
+        urn = body.get("payload", {}).get("URN")
+        if not urn:
+            return
+        urn = normalize_urn(urn)
+        with self._lock:
+            event = self._events.get(urn)
+            if event is not None:
+                event.set()
+                return
+            # Events can arrive before `expect` was called for the URN, or be for URNs of another app sharing the
+            # workflow; remember a bounded number of them for a while instead of keeping an Event per URN forever.
+            now = time.monotonic()
+            self._early[urn] = now
+            self._early.move_to_end(urn)
+            while self._early and (
+                len(self._early) > EARLY_EVENTS_MAX or now - next(iter(self._early.values())) >= EARLY_EVENT_TTL
+            ):
+                self._early.popitem(last=False)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+_receiver: CallbackReceiver | None = None
+_receiver_lock = threading.Lock()
+
+
+def get_receiver() -> CallbackReceiver | None:
+    """Returns the process-wide receiver, starting it on first use. None when webhooks are disabled or the port
+    is taken (e.g. by another worker process), in which case callers just keep polling.
+    """
+    global _receiver
+    if not USE_WEBHOOKS:
+        return None
+    with _receiver_lock:
+        if _receiver is None:
+            try:
+                _receiver = CallbackReceiver()
+            except OSError:
+                return None
+        return _receiver
+
+
+def send_test_event(callback_url: str, urn: str, status: str = "success", workflow: str = WORKFLOW_ID) -> None:
+    """Posts a fake `extraction.finished` event, the way APS would, to a callback receiver. Meant for local testing."""
+    body = {
+        "version": "1.0.0",
+        "resourceUrn": urn,
+        "hook": {"system": "derivative", "event": EXTRACTION_FINISHED, "scope": {"workflow": workflow}},
+        "payload": {"URN": urn, "WorkflowId": workflow, "Status": status},
+    }
+    response = requests.post(callback_url, json=body, timeout=5)
+    response.raise_for_status()